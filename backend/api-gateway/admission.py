@@ -0,0 +1,196 @@
+"""Admission control at the gateway: per-user rate limits and upstream load shedding.
+
+``RateLimiter`` keeps a token bucket per user and route class. The user is
+the token's subject (user type and id). Login and register have no token,
+so they are keyed by client address. A request that finds its bucket
+empty is refused with 429 and a ``Retry-After`` of the time until the next
+token. Each class has its own rate and burst:
+
+    read    GETs under /api/finance/ and POST /api/batch
+    write   creates and other finance writes
+    heavy   bulk imports and exports
+    auth    login and register, per client address
+
+``ConcurrencyLimiter`` caps the calls one upstream has in flight. Calls
+beyond the cap wait in a bounded queue for up to ``queue_timeout`` seconds.
+When the queue is full, or the wait runs out, the call is shed with a 503
+and ``Retry-After`` instead of piling up behind a slow service. A call
+counts as in flight until its response headers arrive.
+
+Like the breakers, limits are per worker process: with N gunicorn workers
+a user can get up to N times their rate, and each worker has its own
+in-flight cap.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from common import metrics
+
+# Unauthenticated routes limited per client address
+AUTH_PATHS = ('/api/auth/login', '/api/auth/register')
+HEAVY_SUFFIXES = ('/bulk', '/export')
+
+
+class Overloaded(Exception):
+    """An upstream call was shed because too many are already in flight"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(name)
+        self.retry_after = retry_after
+
+
+def route_class(request):
+    """The rate limit class for a request, or None when it isn't limited"""
+    if request.method == 'OPTIONS':
+        return None
+    if request.path in AUTH_PATHS:
+        return 'auth'
+    if request.path == '/api/batch':
+        return 'read'
+    if not request.path.startswith('/api/finance/'):
+        return None
+    if request.path.endswith(HEAVY_SUFFIXES):
+        return 'heavy'
+    return 'read' if request.method in ('GET', 'HEAD') else 'write'
+
+
+class RateLimiter:
+    """Token buckets per ``(key, route class)``; ``limits`` maps class -> (rate/s, burst)"""
+
+    def __init__(self, limits, max_keys=10000):
+        self.limits = {name: limit for name, limit in limits.items() if limit[0] > 0}
+        self.max_keys = max_keys
+
+        self._lock = threading.Lock()
+        # (key, class) -> [tokens, updated_at]
+        self._buckets = OrderedDict()
+        self._stats = {name: {'allowed': 0, 'limited': 0} for name in self.limits}
+
+    def acquire(self, key, route_class):
+        """Take a token; returns 0 when allowed, else the seconds until one is available"""
+        limit = self.limits.get(route_class)
+        if limit is None:
+            return 0
+        rate, burst = limit
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get((key, route_class))
+            if bucket is None:
+                bucket = self._buckets[(key, route_class)] = [burst, now]
+                while len(self._buckets) > self.max_keys:
+                    # The least recently seen keys start again with a full bucket
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end((key, route_class))
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                self._stats[route_class]['allowed'] += 1
+                return 0
+            self._stats[route_class]['limited'] += 1
+            retry_after = (1 - bucket[0]) / rate
+        metrics.observe_gateway_shed('rate_limited', route_class)
+        return retry_after
+
+    def stats(self):
+        with self._lock:
+            return {
+                'keys': len(self._buckets),
+                'classes': {
+                    name: dict(self._stats[name], rate=rate, burst=burst)
+                    for name, (rate, burst) in self.limits.items()
+                },
+            }
+
+
+class ConcurrencyLimiter:
+    """At most ``max_in_flight`` calls at once, with up to ``max_queue`` more waiting"""
+
+    def __init__(self, name, max_in_flight=20, max_queue=20, queue_timeout=1.0):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._stats = {'admitted': 0, 'queued': 0, 'shed': 0}
+
+    def acquire(self):
+        """Take a slot, waiting if needed; raises ``Overloaded`` when the call is shed"""
+        with self._cond:
+            if self._in_flight < self.max_in_flight and not self._waiting:
+                self._in_flight += 1
+                self._stats['admitted'] += 1
+                return
+            if self._waiting >= self.max_queue:
+                self._shed()
+
+            started = time.monotonic()
+            deadline = started + self.queue_timeout
+            self._waiting += 1
+            self._stats['queued'] += 1
+            try:
+                while self._in_flight >= self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        # Pass on a wakeup this waiter may have taken
+                        self._cond.notify()
+                        self._shed()
+                    self._cond.wait(remaining)
+                self._in_flight += 1
+                self._stats['admitted'] += 1
+            finally:
+                self._waiting -= 1
+        metrics.observe_upstream_queue_wait(self.name, time.monotonic() - started)
+
+    def _shed(self):
+        self._stats['shed'] += 1
+        metrics.observe_gateway_shed('overloaded', self.name)
+        raise Overloaded(self.name, max(self.queue_timeout, 1))
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, in_flight=self._in_flight, waiting=self._waiting,
+                        max_in_flight=self.max_in_flight, max_queue=self.max_queue)
+
+
+def retry_after_header(seconds):
+    return str(max(math.ceil(seconds), 1))
+
+
+def rate_limiter_from_env():
+    """Build a rate limiter from the RATE_LIMIT_* environment variables, or None when disabled"""
+    if os.getenv('RATE_LIMIT_ENABLED', '1') != '1':
+        return None
+    defaults = {'read': ('20', '60'), 'write': ('5', '20'), 'heavy': ('0.2', '3'), 'auth': ('1', '10')}
+    return RateLimiter(
+        {
+            name: (float(os.getenv(f'RATE_LIMIT_{name.upper()}_PER_SECOND', rate)),
+                   float(os.getenv(f'RATE_LIMIT_{name.upper()}_BURST', burst)))
+            for name, (rate, burst) in defaults.items()
+        },
+        max_keys=int(os.getenv('RATE_LIMIT_MAX_KEYS', '10000')),
+    )
+
+
+def concurrency_limiter_from_env(name):
+    """Build a concurrency limiter for upstream ``name`` from the UPSTREAM_MAX_* and UPSTREAM_QUEUE_TIMEOUT variables"""
+    return ConcurrencyLimiter(
+        name,
+        max_in_flight=int(os.getenv('UPSTREAM_MAX_IN_FLIGHT', os.getenv('UPSTREAM_POOL_SIZE', '20'))),
+        max_queue=int(os.getenv('UPSTREAM_MAX_QUEUE', '20')),
+        queue_timeout=float(os.getenv('UPSTREAM_QUEUE_TIMEOUT', '1')),
+    )
@@ -1,81 +1,223 @@
 
-from flask import Flask, request, jsonify, redirect
+from flask import Flask, g, request, jsonify, redirect
 from flask_cors import CORS
-import requests
+import jwt
 import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import fastjson, metrics, profiling, timing
+from common.tokens import bearer_token, verifier_from_env
+import admission
+import batch
+import compression
+from breaker import breaker_from_env
+from coalesce import coalescer_from_env
+from health import health_check_from_env
+from proxy import Upstream
 
 app = Flask(__name__)
+app.json = fastjson.JSONProvider(app)
 CORS(app)
+timing.init_app(app, 'gateway')
+metrics.init_app(app, 'gateway')
+profiling.init_app(app, 'gateway')
 
 # Service URLs
 AUTH_SERVICE_URL = os.getenv('AUTH_SERVICE_URL', 'http://auth-service:5001')
 FINANCE_SERVICE_URL = os.getenv('FINANCE_SERVICE_URL', 'http://finance-service:5002')
+SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
 
-def proxy_request(service_url, path, method='GET'):
-    """Proxy request to microservice"""
-    try:
-        url = f"{service_url}{path}"
-        headers = {}
-        
-        # Forward authorization header
-        if 'Authorization' in request.headers:
-            headers['Authorization'] = request.headers['Authorization']
-        
-        if method == 'GET':
-            response = requests.get(url, headers=headers, params=request.args)
-        elif method == 'POST':
-            response = requests.post(url, headers=headers, json=request.get_json())
-        elif method == 'PUT':
-            response = requests.put(url, headers=headers, json=request.get_json())
-        elif method == 'DELETE':
-            response = requests.delete(url, headers=headers)
-        
-        return jsonify(response.json()), response.status_code
-    except requests.exceptions.RequestException as e:
-        return jsonify({'error': f'Service unavailable: {str(e)}'}), 503
+# Routes under these prefixes need a valid token before they are proxied
+PROTECTED_PREFIXES = ('/api/finance/', '/api/batch')
+
+token_verifier = verifier_from_env(SECRET_KEY)
+
+auth_upstream = Upstream('auth', AUTH_SERVICE_URL, breaker=breaker_from_env('auth'),
+                         limiter=admission.concurrency_limiter_from_env('auth'))
+finance_upstream = Upstream('finance', FINANCE_SERVICE_URL, breaker=breaker_from_env('finance'),
+                            limiter=admission.concurrency_limiter_from_env('finance'))
+upstreams = (auth_upstream, finance_upstream)
+
+health_check = health_check_from_env(upstreams)
+
+# Identical concurrent reads by one user share a single upstream call
+read_coalescer = coalescer_from_env()
+
+# Per-user token buckets for each route class; None when RATE_LIMIT_ENABLED=0
+rate_limiter = admission.rate_limiter_from_env()
+
+# Negotiated gzip/br/zstd for JSON responses, with compressed bodies cached by ETag
+compressor = compression.compressor_from_env()
+
+def proxy_request(upstream, path, method='GET'):
+    """Proxy request to microservice, streaming the response back unchanged"""
+    return upstream.forward(path, method)
+
+def user_key():
+    user = g.user
+    return (user.get('type'), user.get('user_id'))
+
+def proxy_read(upstream, path):
+    """Proxy a GET, sharing the response with identical concurrent or recent reads"""
+    if 'no-cache' in request.headers.get('Cache-Control', ''):
+        return proxy_request(upstream, path, 'GET')
+    return read_coalescer.get(
+        read_coalescer.key(user_key(), request),
+        lambda: app.make_response(proxy_request(upstream, path, 'GET'))
+    )
+
+def proxy_write(upstream, path):
+    """Proxy a write; the user's cached and in-flight reads are dropped around it"""
+    read_coalescer.invalidate(user_key())
+    response = proxy_request(upstream, path, request.method)
+    read_coalescer.invalidate(user_key())
+    return response
+
+@app.before_request
+def strip_compressed_etags():
+    # Upstreams only know the uncompressed ETags
+    compression.strip_etag_suffixes(request.environ)
+
+@app.after_request
+def compress_response(response):
+    return compressor.process(request, response, user_key() if 'user' in g else None)
+
+@app.before_request
+def authenticate_at_edge():
+    """Reject protected calls with a missing or invalid token without proxying them"""
+    if request.method == 'OPTIONS' or not request.path.startswith(PROTECTED_PREFIXES):
+        return None
+    
+    token = bearer_token(request.headers.get('Authorization'))
+    if not token:
+        return jsonify({'error': 'Token required'}), 401
+    
+    started = time.perf_counter()
+    user = token_verifier.verify(token)
+    metrics.observe_token_verify(time.perf_counter() - started)
+    if not user:
+        return jsonify({'error': 'Invalid token'}), 401
+    g.user = user
+
+@app.before_request
+def rate_limit():
+    """Refuse calls over the user's rate for their route class with a 429"""
+    route_class = admission.route_class(request) if rate_limiter else None
+    if route_class is None:
+        return None
+    
+    key = user_key() if 'user' in g else request.remote_addr
+    retry_after = rate_limiter.acquire(key, route_class)
+    if retry_after:
+        response = jsonify({'error': 'Too many requests'})
+        response.headers['Retry-After'] = admission.retry_after_header(retry_after)
+        return response, 429
 
 # Auth service routes
 @app.route('/api/auth/login', methods=['POST'])
 def login():
-    return proxy_request(AUTH_SERVICE_URL, '/login', 'POST')
+    return proxy_request(auth_upstream, '/login', 'POST')
 
 @app.route('/api/auth/register', methods=['POST'])
 def register():
-    return proxy_request(AUTH_SERVICE_URL, '/register', 'POST')
+    return proxy_request(auth_upstream, '/register', 'POST')
 
 @app.route('/api/auth/verify', methods=['POST'])
 def verify():
-    return proxy_request(AUTH_SERVICE_URL, '/verify', 'POST')
+    # Answered locally; same contract as auth-service's /verify
+    token = bearer_token(request.headers.get('Authorization'))
+    if not token:
+        return jsonify({'error': 'Token required'}), 401
+    
+    try:
+        payload = token_verifier.decode(token)
+        return jsonify({'user': payload}), 200
+    except jwt.ExpiredSignatureError:
+        return jsonify({'error': 'Token expired'}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({'error': 'Invalid token'}), 401
 
 # Finance service routes
 @app.route('/api/finance/expenses', methods=['GET', 'POST'])
 def expenses():
-    return proxy_request(FINANCE_SERVICE_URL, '/expenses', request.method)
+    if request.method == 'GET':
+        return proxy_read(finance_upstream, '/expenses')
+    return proxy_write(finance_upstream, '/expenses')
+
+@app.route('/api/finance/expenses/search', methods=['GET'])
+def expenses_search():
+    return proxy_read(finance_upstream, '/expenses/search')
 
 @app.route('/api/finance/income', methods=['GET', 'POST'])
 def income():
-    return proxy_request(FINANCE_SERVICE_URL, '/income', request.method)
+    if request.method == 'GET':
+        return proxy_read(finance_upstream, '/income')
+    return proxy_write(finance_upstream, '/income')
+
+# Bulk imports stream the upload through to finance-service without buffering it
+@app.route('/api/finance/expenses/bulk', methods=['POST'])
+def expenses_bulk():
+    return proxy_write(finance_upstream, '/expenses/bulk')
+
+@app.route('/api/finance/income/bulk', methods=['POST'])
+def income_bulk():
+    return proxy_write(finance_upstream, '/income/bulk')
 
 @app.route('/api/finance/budget', methods=['GET'])
 def budget():
-    return proxy_request(FINANCE_SERVICE_URL, '/budget', 'GET')
+    return proxy_read(finance_upstream, '/budget')
+
+@app.route('/api/finance/reports/summary', methods=['GET'])
+def reports_summary():
+    return proxy_read(finance_upstream, '/reports/summary')
+
+# Exports stream through without buffering, however large the ledger
+@app.route('/api/finance/export', methods=['GET'])
+def export_ledger():
+    return proxy_request(finance_upstream, '/export', 'GET')
+
+@app.route('/api/finance/dashboard', methods=['GET'])
+def dashboard():
+    return proxy_read(finance_upstream, '/dashboard')
+
+# Several finance reads in one round trip, sharing the edge auth check
+@app.route('/api/batch', methods=['POST'])
+def batch_requests():
+    try:
+        items = batch.parse(request.get_json(silent=True))
+    except batch.BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    headers = {'Authorization': request.headers['Authorization'], 'Accept': 'application/json'}
+    headers[metrics.REQUEST_ID_HEADER] = metrics.request_id()
+    if profiling.PROFILE_HEADER in request.headers:
+        headers[profiling.PROFILE_HEADER] = request.headers[profiling.PROFILE_HEADER]
+    return jsonify(batch.encode(batch.run(items, finance_upstream, headers)))
 
 # Health check
 @app.route('/health', methods=['GET'])
 def health():
-    try:
-        auth_health = requests.get(f"{AUTH_SERVICE_URL}/health", timeout=5)
-        finance_health = requests.get(f"{FINANCE_SERVICE_URL}/health", timeout=5)
-        
-        return jsonify({
-            'status': 'healthy',
-            'services': {
-                'auth': auth_health.json() if auth_health.status_code == 200 else 'unhealthy',
-                'finance': finance_health.json() if finance_health.status_code == 200 else 'unhealthy'
-            }
-        })
-    except:
-        return jsonify({'status': 'unhealthy'}), 503
+    # Probed concurrently and cached briefly, so a dead service can't stall this
+    results = health_check.results()
+    healthy = all(result is not None for result in results.values())
+    
+    return jsonify({
+        'status': 'healthy' if healthy else 'unhealthy',
+        'services': {
+            name: result if result is not None else 'unhealthy'
+            for name, result in results.items()
+        },
+        'breakers': {upstream.name: upstream.breaker.snapshot() for upstream in upstreams},
+        'read_coalescing': read_coalescer.stats(),
+        'compression': compressor.stats(),
+        'admission': {
+            'rate_limits': rate_limiter.stats() if rate_limiter else None,
+            'upstreams': {upstream.name: upstream.limiter.stats() for upstream in upstreams},
+        },
+        'token_cache': token_verifier.stats()
+    }), 200 if healthy else 503
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000, debug=os.getenv('FLASK_DEBUG') == '1')
@@ -0,0 +1,170 @@
+"""``POST /api/batch``: several finance reads in one round trip.
+
+The request body lists GET sub-requests by their gateway path:
+
+    {"requests": [
+        {"id": "expenses", "path": "/api/finance/expenses?limit=10"},
+        {"id": "income", "path": "/api/finance/income?limit=10"},
+        {"id": "budget", "path": "/api/finance/budget"}
+    ]}
+
+The batch is authenticated once at the edge. Its sub-requests run in
+parallel and the response lists each one's status and JSON body, in request
+order:
+
+    {"responses": [{"id": "expenses", "status": 200, "body": {...}}, ...]}
+
+Expenses, income and budget reads that only set ``limit`` are folded into a
+single call to finance-service's ``/dashboard``. That call answers all of
+them from one connection and one consistent snapshot.
+
+Other JSON bodies are copied into the batch response as finance-service
+encoded them, without being parsed and encoded again.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import requests
+
+from admission import Overloaded
+from breaker import CircuitOpen
+from common import fastjson
+
+MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '10'))
+CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+
+# Gateway read paths a batch may contain -> finance-service path
+READ_ROUTES = {
+    '/api/finance/expenses': '/expenses',
+    '/api/finance/expenses/search': '/expenses/search',
+    '/api/finance/income': '/income',
+    '/api/finance/budget': '/budget',
+    '/api/finance/reports/summary': '/reports/summary',
+    '/api/finance/dashboard': '/dashboard',
+}
+
+# Reads that /dashboard can answer -> its dataset name
+DASHBOARD_DATASETS = {
+    '/api/finance/expenses': 'expenses',
+    '/api/finance/income': 'income',
+    '/api/finance/budget': 'budget',
+}
+
+_executor = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix='batch')
+
+
+class BatchError(ValueError):
+    """Raised for a malformed batch body"""
+
+
+def parse(body):
+    """Validate a batch body into ``[{'id', 'path', 'query'}]``"""
+    if not isinstance(body, dict) or not isinstance(body.get('requests'), list):
+        raise BatchError('Body must be {"requests": [...]}')
+    entries = body['requests']
+    if not entries:
+        raise BatchError('requests must not be empty')
+    if len(entries) > MAX_ITEMS:
+        raise BatchError(f'At most {MAX_ITEMS} requests per batch')
+
+    items = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not isinstance(entry.get('path'), str):
+            raise BatchError(f'requests[{index}] needs a path')
+        if entry.get('method', 'GET').upper() != 'GET':
+            raise BatchError(f'requests[{index}]: only GET is supported')
+        url = urlsplit(entry['path'])
+        if url.path not in READ_ROUTES:
+            raise BatchError(f'requests[{index}]: {url.path} cannot be batched')
+        items.append({'id': entry.get('id', index), 'path': url.path, 'query': url.query})
+    return items
+
+
+def _dashboard_limit(item):
+    """The ``limit`` of a read /dashboard can answer, '' for budgets, else None"""
+    if item['path'] not in DASHBOARD_DATASETS:
+        return None
+    query = parse_qs(item['query'], keep_blank_values=True)
+    if item['path'] == '/api/finance/budget':
+        return '' if not query else None
+    if set(query) == {'limit'} and len(query['limit']) == 1:
+        return query['limit'][0]
+    return None
+
+
+def _fold(items):
+    """Pick the items one /dashboard call can answer; returns ``(items, query)``"""
+    by_limit = {}
+    for item in items:
+        limit = _dashboard_limit(item)
+        if limit is not None:
+            by_limit.setdefault(limit, []).append(item)
+    budget_items = by_limit.pop('', [])
+    if not by_limit:
+        return [], None
+    # Lists must share one limit; go with the most common one
+    limit, folded = max(by_limit.items(), key=lambda pair: len(pair[1]))
+    folded = folded + budget_items
+    if len(folded) < 2:
+        return [], None
+    datasets = dict.fromkeys(DASHBOARD_DATASETS[item['path']] for item in folded)
+    return folded, urlencode({'include': ','.join(datasets), 'limit': limit})
+
+
+def _call(upstream, path, query, headers, parse=False):
+    """``(status, body)``; a JSON body stays ``fastjson.Raw`` unless ``parse`` is set"""
+    try:
+        response = upstream.call('GET', path, headers=headers,
+                                 query_string=query.encode('latin-1'), stream=False)
+    except CircuitOpen:
+        return 503, {'error': f'Service unavailable: {upstream.name} is failing, try again shortly'}
+    except Overloaded:
+        return 503, {'error': f'Service unavailable: {upstream.name} is overloaded, try again shortly'}
+    except requests.exceptions.RequestException as e:
+        return 503, {'error': f'Service unavailable: {str(e)}'}
+    if response.headers.get('Content-Type', '').startswith('application/json'):
+        body = response.content.decode()
+        if not parse:
+            return response.status_code, fastjson.Raw(body.strip())
+        try:
+            return response.status_code, fastjson.loads(body)
+        except ValueError:
+            pass
+    return response.status_code, response.text
+
+
+def run(items, upstream, headers):
+    """Run the sub-requests against ``upstream`` in parallel; returns the response list"""
+    folded, dashboard_query = _fold(items)
+    folded_ids = {id(item) for item in folded}
+
+    futures = {}
+    if dashboard_query:
+        # Parsed, since each dataset goes to a different item
+        futures['dashboard'] = _executor.submit(_call, upstream, '/dashboard', dashboard_query, headers, True)
+    for item in items:
+        if id(item) not in folded_ids:
+            futures[id(item)] = _executor.submit(
+                _call, upstream, READ_ROUTES[item['path']], item['query'], headers
+            )
+
+    dashboard = futures['dashboard'].result() if dashboard_query else None
+    responses = []
+    for item in items:
+        if id(item) in folded_ids:
+            status, body = dashboard
+            if status == 200:
+                body = body[DASHBOARD_DATASETS[item['path']]]
+        else:
+            status, body = futures[id(item)].result()
+        responses.append({'id': item['id'], 'status': status, 'body': body})
+    return responses
+
+
+def encode(responses):
+    """The batch response body for ``run``'s result"""
+    return fastjson.Raw(fastjson.encode_object({'responses': fastjson.Raw(fastjson.encode_array([
+        fastjson.encode_object(response) for response in responses
+    ]))}))
@@ -0,0 +1,164 @@
+"""Circuit breakers for the gateway's upstream services.
+
+A breaker tracks the outcome of every call to one upstream over a rolling
+window. A call fails when no response arrives (connection error or timeout)
+or the status is one of ``FAILURE_STATUSES``. Other 5xx responses don't
+count. finance-service answers malformed input with a 500, so counting those
+would let one client sending junk open the breaker for every user. A call is
+slow when its response headers take ``slow_call_seconds`` or longer. The
+breaker opens once the window holds at least ``min_calls`` calls and either
+the failed share reaches ``error_rate`` or the slow share reaches
+``slow_rate``.
+
+While the breaker is open, calls are refused immediately. After
+``open_seconds`` it goes half-open and lets ``half_open_calls`` calls through
+as recovery probes. If every probe succeeds the breaker closes; if any probe
+fails or is slow it opens again.
+
+Breaker state is kept per process, so each gunicorn worker trips on its own.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Upstream statuses that mean the service itself is unavailable
+FAILURE_STATUSES = (502, 503, 504)
+
+
+class CircuitOpen(Exception):
+    """An upstream call was refused because its breaker is open"""
+
+
+class CircuitBreaker:
+    def __init__(self, name, window=30.0, min_calls=20, error_rate=0.5,
+                 slow_call_seconds=5.0, slow_rate=0.8, open_seconds=10.0, half_open_calls=3):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        # (finished_at, failed, slow) for the calls in the window, with running totals
+        self._calls = deque()
+        self._failed = 0
+        self._slow = 0
+        self._changed_at = time.monotonic()
+        self._probes = 0
+        self._probe_successes = 0
+        self._stats = {'opened': 0, 'rejected': 0}
+
+    def allow(self):
+        """Whether a call may go to the upstream now; each allowed call must be recorded"""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == OPEN and now - self._changed_at >= self.open_seconds:
+                self._half_open(now)
+            elif self._state == HALF_OPEN and self._probes >= self.half_open_calls \
+                    and now - self._changed_at >= self.open_seconds:
+                # Probes that never reported back must not wedge the breaker
+                self._half_open(now)
+
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def record(self, failed, seconds):
+        """Report the outcome of an allowed call"""
+        slow = seconds >= self.slow_call_seconds
+        with self._lock:
+            now = time.monotonic()
+            if self._state == HALF_OPEN:
+                if failed or slow:
+                    self._open(now)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    self._close(now)
+                return
+            if self._state == OPEN:
+                # Started before the breaker opened
+                return
+
+            self._calls.append((now, failed, slow))
+            self._failed += failed
+            self._slow += slow
+            self._expire(now)
+            total = len(self._calls)
+            if total >= self.min_calls and (
+                    self._failed / total >= self.error_rate or self._slow / total >= self.slow_rate):
+                self._open(now)
+
+    def retry_after(self):
+        """Seconds until the breaker next lets a probe through"""
+        with self._lock:
+            if self._state == CLOSED:
+                return 0
+            return max(self.open_seconds - (time.monotonic() - self._changed_at), 0)
+
+    def _expire(self, now):
+        while self._calls and now - self._calls[0][0] > self.window:
+            _, failed, slow = self._calls.popleft()
+            self._failed -= failed
+            self._slow -= slow
+
+    def _open(self, now):
+        self._state = OPEN
+        self._changed_at = now
+        self._stats['opened'] += 1
+        print(f"Circuit breaker for {self.name} opened")
+
+    def _half_open(self, now):
+        self._state = HALF_OPEN
+        self._changed_at = now
+        self._probes = 0
+        self._probe_successes = 0
+
+    def _close(self, now):
+        self._state = CLOSED
+        self._changed_at = now
+        self._calls.clear()
+        self._failed = 0
+        self._slow = 0
+        print(f"Circuit breaker for {self.name} closed")
+
+    def snapshot(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            total = len(self._calls)
+            return dict(
+                self._stats,
+                state=self._state,
+                calls=total,
+                error_rate=round(self._failed / total, 3) if total else 0.0,
+                slow_rate=round(self._slow / total, 3) if total else 0.0,
+                since=round(time.monotonic() - self._changed_at, 1),
+            )
+
+
+def breaker_from_env(name):
+    """Build a breaker configured from the BREAKER_* environment variables"""
+    return CircuitBreaker(
+        name,
+        window=float(os.getenv('BREAKER_WINDOW', '30')),
+        min_calls=int(os.getenv('BREAKER_MIN_CALLS', '20')),
+        error_rate=float(os.getenv('BREAKER_ERROR_RATE', '0.5')),
+        slow_call_seconds=float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '5')),
+        slow_rate=float(os.getenv('BREAKER_SLOW_RATE', '0.8')),
+        open_seconds=float(os.getenv('BREAKER_OPEN_SECONDS', '10')),
+        half_open_calls=int(os.getenv('BREAKER_HALF_OPEN_CALLS', '3')),
+    )
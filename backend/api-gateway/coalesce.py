@@ -0,0 +1,155 @@
+"""Request coalescing and a micro-TTL response cache for reads through the gateway.
+
+Identical GETs from the same user (same path, query string and content
+negotiation headers) that arrive while one is already in flight wait for it
+and get a copy of its response, so only one of them reaches the upstream
+service. With ``ttl`` > 0, successful responses are also kept for that many
+seconds.
+
+Any write by a user drops that user's cached responses and detaches their
+in-flight reads, so later reads always see the write. Like every cache in
+the gateway this is per worker process: a write handled by one worker does
+not clear another worker's cache, which can serve a stale response for up to
+``ttl`` seconds. Keep the TTL short. Coalescing only helps when a worker
+handles requests concurrently (GUNICORN_THREADS > 1).
+
+Only responses with a Content-Length of at most ``max_body`` bytes are
+shared. Streamed responses such as NDJSON pages pass through untouched.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response
+
+from common import metrics
+
+# Request headers that change the response, besides the path and query string
+KEY_HEADERS = ('Accept', 'Accept-Encoding', 'If-None-Match', 'If-Modified-Since')
+
+CACHEABLE_STATUSES = (200, 304)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.detached = False
+
+
+class ReadCoalescer:
+    """Single-flight GETs, plus an optional micro-TTL cache, keyed per user"""
+
+    def __init__(self, ttl=0.0, max_entries=1000, max_body=1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_body = max_body
+
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._cache = OrderedDict()
+        self._stats = {'misses': 0, 'coalesced': 0, 'hits': 0, 'bypassed': 0, 'invalidations': 0}
+
+    @staticmethod
+    def key(user_key, request):
+        return (user_key, request.path, request.query_string) + tuple(
+            request.headers.get(name, '') for name in KEY_HEADERS
+        )
+
+    def get(self, key, fetch):
+        """Answer a read, calling ``fetch()`` for a Flask response only when needed"""
+        route = key[1]
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                result, expires_at = entry
+                if time.monotonic() < expires_at:
+                    self._cache.move_to_end(key)
+                    self._count(route, 'hits')
+                    return _respond(result)
+                del self._cache[key]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._count(route, 'misses')
+            else:
+                self._count(route, 'coalesced')
+
+        if not leader:
+            flight.done.wait()
+            if flight.result is None:
+                # The leader's response couldn't be shared
+                with self._lock:
+                    self._count(route, 'bypassed')
+                return fetch()
+            return _respond(flight.result)
+
+        result = None
+        try:
+            response = fetch()
+            result = self._freeze(response)
+            return response if result is None else _respond(result)
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                if result is not None and self.ttl > 0 and not flight.detached \
+                        and result[0] in CACHEABLE_STATUSES:
+                    self._cache[key] = (result, time.monotonic() + self.ttl)
+                    while len(self._cache) > self.max_entries:
+                        self._cache.popitem(last=False)
+            flight.result = result
+            flight.done.set()
+
+    def invalidate(self, user_key):
+        """Forget ``user_key``'s cached responses and detach their in-flight reads"""
+        with self._lock:
+            self._stats['invalidations'] += 1
+            for key in [key for key in self._cache if key[0] == user_key]:
+                del self._cache[key]
+            for key in [key for key in self._flights if key[0] == user_key]:
+                self._flights.pop(key).detached = True
+
+    def _freeze(self, response):
+        """``(status, headers, body)`` for a response small enough to share, else None"""
+        length = response.content_length
+        if length is None or length > self.max_body:
+            return None
+        body = b''.join(response.iter_encoded())
+        response.close()
+        headers = [(name, value) for name, value in response.headers if name.lower() != 'content-length']
+        return response.status_code, headers, body
+
+    def _count(self, route, result):
+        self._stats[result] += 1
+        metrics.observe_gateway_read(route, result)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._flights)
+            stats['size'] = len(self._cache)
+            stats['ttl'] = self.ttl
+            return stats
+
+
+def _respond(result):
+    status, headers, body = result
+    return Response(body, status=status, headers=headers)
+
+
+def coalescer_from_env():
+    """Build a coalescer configured from the RESPONSE_CACHE_* environment variables"""
+    return ReadCoalescer(
+        ttl=float(os.getenv('RESPONSE_CACHE_TTL', '0')),
+        max_entries=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1000')),
+        max_body=int(os.getenv('RESPONSE_CACHE_MAX_BODY', str(1024 * 1024))),
+    )
@@ -0,0 +1,222 @@
+"""Compress gateway responses for clients that accept it, caching the results.
+
+Each response the gateway returns is checked in an ``after_request`` hook.
+It is compressed when all of these hold:
+
+  - it is a 200 with a JSON or text body of known length, between
+    ``min_size`` and ``max_body`` bytes
+  - it has no Content-Encoding yet
+  - the client's ``Accept-Encoding`` allows one of the enabled encodings
+
+When the client ranks several equally, the first enabled one wins (zstd,
+then br, then gzip by default). brotli and zstandard are optional installs:
+an encoding whose module is missing is never used. Streamed responses, such
+as NDJSON pages and exports, pass through untouched.
+
+A compressed body gets its own strong ETag: the upstream tag plus
+``-<encoding>``. The suffix is stripped from ``If-None-Match`` before the
+request is proxied, so finance-service still answers revalidations with
+304.
+
+Compressed bodies are cached by user, upstream ETag and encoding. The
+ETag comes from the user's data version, so a repeat read of unchanged data
+is served from the cache without compressing it again, and any write
+changes the key. The cache is per worker process and bounded by
+``cache_max_bytes``. The least recently used bodies are dropped first.
+"""
+
+import gzip
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from common import metrics, timing
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+# Level for each encoding: fast enough to run per request, most of the size win
+LEVELS = {'gzip': 6, 'br': 5, 'zstd': 3}
+
+_ETAG_SUFFIX_RE = re.compile(r'-(?:gzip|br|zstd)"')
+ORIGINAL_IF_NONE_MATCH = 'finflow.if_none_match'
+
+
+def _gzip(data):
+    return gzip.compress(data, compresslevel=LEVELS['gzip'], mtime=0)
+
+
+def _brotli(data):
+    return brotli.compress(data, quality=LEVELS['br'])
+
+
+def _zstd(data):
+    # Compressor objects can't be shared between threads; they are cheap to make
+    return zstandard.ZstdCompressor(level=LEVELS['zstd']).compress(data)
+
+
+# Server preference order
+CODECS = {'zstd': _zstd, 'br': _brotli, 'gzip': _gzip}
+
+
+def available_encodings():
+    """Encodings whose module is installed, in preference order"""
+    missing = {'br': brotli is None, 'zstd': zstandard is None}
+    return [name for name in CODECS if not missing.get(name)]
+
+
+def negotiate(accept_encodings, encodings):
+    """The encoding to use for a werkzeug ``Accept-Encoding`` value, or None for identity"""
+    best, best_quality = None, 0
+    for name in encodings:
+        quality = accept_encodings.quality(name)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    if best is not None and accept_encodings.quality('identity') > best_quality:
+        return None
+    return best
+
+
+def strip_etag_suffixes(environ):
+    """Remove our ``-<encoding>`` ETag suffixes from If-None-Match before it is proxied"""
+    value = environ.get('HTTP_IF_NONE_MATCH')
+    if value:
+        stripped = _ETAG_SUFFIX_RE.sub('"', value)
+        if stripped != value:
+            environ[ORIGINAL_IF_NONE_MATCH] = value
+            environ['HTTP_IF_NONE_MATCH'] = stripped
+
+
+class Compressor:
+    """Negotiated response compression with an LRU cache of compressed bodies"""
+
+    def __init__(self, encodings=None, min_size=1024, max_body=8 * 1024 * 1024,
+                 cache_max_bytes=64 * 1024 * 1024):
+        installed = available_encodings()
+        if encodings is None:
+            encodings = installed
+        self.encodings = [name for name in encodings if name in installed]
+        self.min_size = min_size
+        self.max_body = max_body
+        self.cache_max_bytes = cache_max_bytes
+
+        self._lock = threading.Lock()
+        # (user, upstream etag, encoding) -> (identity length, compressed body)
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._stats = {'compressed': 0, 'cache_hits': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_seconds': 0.0}
+
+    def process(self, request, response, user=None):
+        """Compress ``response`` in place when it qualifies; ``user`` scopes the cache"""
+        if response.status_code == 304:
+            self._restore_etag(request, response)
+            return response
+        if not self.encodings or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+
+        length = response.content_length
+        if response.status_code != 200 or request.method == 'HEAD' \
+                or 'Content-Encoding' in response.headers \
+                or length is None or not self.min_size <= length <= self.max_body:
+            return response
+        encoding = negotiate(request.accept_encodings, self.encodings)
+        if encoding is None:
+            return response
+
+        body = b''.join(response.iter_encoded())
+        response.close()
+        etag, weak = response.get_etag()
+        key = (user, etag, encoding) if etag else None
+
+        compressed = self._cached(key, len(body))
+        if compressed is None:
+            started = time.thread_time()
+            with timing.timed('compress'):
+                compressed = CODECS[encoding](body)
+            cpu_seconds = time.thread_time() - started
+            self._store(key, len(body), compressed, cpu_seconds)
+            metrics.observe_compression(encoding, 'compressed', len(body) - len(compressed), cpu_seconds)
+        else:
+            metrics.observe_compression(encoding, 'cached', len(body) - len(compressed))
+        with self._lock:
+            self._stats['bytes_in'] += len(body)
+            self._stats['bytes_out'] += len(compressed)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            response.set_etag(f'{etag}-{encoding}', weak)
+        return response
+
+    def _restore_etag(self, request, response):
+        """Give a 304 the suffixed ETag the client asked about"""
+        original = request.environ.get(ORIGINAL_IF_NONE_MATCH)
+        etag, weak = response.get_etag()
+        if original and etag:
+            for encoding in CODECS:
+                if f'"{etag}-{encoding}"' in original:
+                    response.set_etag(f'{etag}-{encoding}', weak)
+                    break
+
+    def _cached(self, key, length):
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._cache.get(key)
+            # The length guards against a body that changed under the same ETag
+            if entry is None or entry[0] != length:
+                return None
+            self._cache.move_to_end(key)
+            self._stats['cache_hits'] += 1
+            return entry[1]
+
+    def _store(self, key, length, compressed, cpu_seconds):
+        with self._lock:
+            self._stats['compressed'] += 1
+            self._stats['cpu_seconds'] += cpu_seconds
+            if key is None or len(compressed) > self.cache_max_bytes:
+                return
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._cache_bytes -= len(old[1])
+            self._cache[key] = (length, compressed)
+            self._cache_bytes += len(compressed)
+            while self._cache_bytes > self.cache_max_bytes:
+                _, (_, evicted) = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(
+                encodings=self.encodings,
+                bytes_saved=stats['bytes_in'] - stats['bytes_out'],
+                cpu_seconds=round(stats['cpu_seconds'], 6),
+                cache_entries=len(self._cache),
+                cache_bytes=self._cache_bytes,
+                min_size=self.min_size,
+            )
+            return stats
+
+
+def compressor_from_env():
+    """Build a compressor configured from the COMPRESSION_* environment variables"""
+    encodings = os.getenv('COMPRESSION_ENCODINGS', 'zstd,br,gzip')
+    return Compressor(
+        encodings=[name.strip() for name in encodings.split(',') if name.strip()],
+        min_size=int(os.getenv('COMPRESSION_MIN_SIZE', '1024')),
+        max_body=int(os.getenv('COMPRESSION_MAX_BODY', str(8 * 1024 * 1024))),
+        cache_max_bytes=int(os.getenv('COMPRESSION_CACHE_MAX_BYTES', str(64 * 1024 * 1024))),
+    )
@@ -0,0 +1,53 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+class HealthCheck:
+    """Probe each upstream's /health concurrently, caching the results for ``ttl`` seconds.
+
+    A probe that fails, times out or returns a non-200 status reports None.
+    Probes don't go through the circuit breakers, so they keep working while a
+    breaker is open. Callers that arrive during a refresh wait for it.
+    """
+
+    def __init__(self, upstreams, ttl=2.0, timeout=2.0):
+        self.upstreams = list(upstreams)
+        self.ttl = ttl
+        self.timeout = timeout
+
+        self._executor = ThreadPoolExecutor(max_workers=len(self.upstreams), thread_name_prefix='health')
+        self._lock = threading.Lock()
+        self._results = None
+        self._expires_at = 0.0
+
+    def _probe(self, upstream):
+        try:
+            response = upstream.send('GET', '/health', stream=False, timeout=self.timeout)
+            return response.json() if response.status_code == 200 else None
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+
+    def results(self):
+        """Latest ``{name: health body or None}`` for every upstream"""
+        with self._lock:
+            if self._results is None or time.monotonic() >= self._expires_at:
+                futures = {
+                    upstream.name: self._executor.submit(self._probe, upstream)
+                    for upstream in self.upstreams
+                }
+                self._results = {name: future.result() for name, future in futures.items()}
+                self._expires_at = time.monotonic() + self.ttl
+            return self._results
+
+
+def health_check_from_env(upstreams):
+    """Build a health check configured from the HEALTH_* environment variables"""
+    return HealthCheck(
+        upstreams,
+        ttl=float(os.getenv('HEALTH_CACHE_TTL', '2')),
+        timeout=float(os.getenv('HEALTH_TIMEOUT', '2')),
+    )
@@ -0,0 +1,195 @@
+
+import math
+import os
+import time
+
+import requests
+from flask import Response, jsonify, request
+from requests.adapters import HTTPAdapter
+
+from admission import Overloaded, retry_after_header
+from breaker import FAILURE_STATUSES, CircuitOpen
+from common import metrics
+
+CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '3.05'))
+READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', '30'))
+POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', '20'))
+
+# Request bodies up to this size are forwarded with a Content-Length; larger
+# or unsized bodies are streamed to the upstream with chunked encoding.
+BUFFERED_BODY_LIMIT = int(os.getenv('UPSTREAM_BUFFERED_BODY_LIMIT', str(1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+FORWARDED_REQUEST_HEADERS = (
+    'Authorization',
+    'Content-Type',
+    'Content-Encoding',
+    'Accept',
+    'Accept-Encoding',
+    'If-None-Match',
+    'If-Modified-Since',
+    # Profiles the request in each service it reaches (common/profiling.py)
+    'X-Profile',
+)
+
+# Hop-by-hop headers (RFC 7230 section 6.1) are never forwarded. CORS, Server
+# and Date headers are dropped too because the gateway's own server sets them.
+EXCLUDED_RESPONSE_HEADERS = {
+    'server',
+    'date',
+    'connection',
+    'keep-alive',
+    'proxy-authenticate',
+    'proxy-authorization',
+    'te',
+    'trailer',
+    'transfer-encoding',
+    'upgrade',
+    'access-control-allow-origin',
+    'access-control-allow-credentials',
+    'access-control-allow-headers',
+    'access-control-allow-methods',
+    'access-control-expose-headers',
+    'access-control-max-age',
+}
+
+
+class Upstream:
+    """A backend service reached through its own pool of keep-alive connections.
+
+    With a ``breaker``, forwarded calls are refused with a 503 while it is open.
+    With a ``limiter``, calls beyond its in-flight cap queue briefly and are
+    then shed with a 503.
+    """
+
+    def __init__(self, name, base_url, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, pool_size=POOL_SIZE, breaker=None, limiter=None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker
+        self.limiter = limiter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Don't let requests advertise gzip on the client's behalf
+        self.session.headers['Accept-Encoding'] = 'identity'
+
+    def send(self, method, path, headers=None, data=None, query_string=b'', stream=True, timeout=None):
+        url = f"{self.base_url}{path}"
+        if query_string:
+            url = f"{url}?{query_string.decode('latin-1')}"
+        return self.session.request(
+            method, url, headers=headers, data=data,
+            timeout=timeout or self.timeout, stream=stream, allow_redirects=False
+        )
+
+    def call(self, method, path, headers=None, data=None, query_string=b'', stream=True):
+        """``send()`` guarded by the breaker and recorded in the upstream metrics.
+
+        Raises ``CircuitOpen`` while the breaker is open, ``Overloaded`` when
+        the limiter sheds the call, and the ``requests`` exception when the
+        call fails.
+        """
+        # The slot is taken first: a call the breaker allows must be recorded,
+        # so it can't be shed afterwards
+        if self.limiter:
+            self.limiter.acquire()
+        try:
+            if self.breaker and not self.breaker.allow():
+                metrics.observe_upstream_error(self.name, CircuitOpen())
+                raise CircuitOpen(self.name)
+
+            started = time.perf_counter()
+            try:
+                response = self.send(method, path, headers=headers, data=data,
+                                     query_string=query_string, stream=stream)
+            except requests.exceptions.RequestException as e:
+                if self.breaker:
+                    self.breaker.record(True, time.perf_counter() - started)
+                metrics.observe_upstream_error(self.name, e)
+                raise
+        finally:
+            if self.limiter:
+                self.limiter.release()
+
+        elapsed = time.perf_counter() - started
+        if self.breaker:
+            self.breaker.record(response.status_code in FAILURE_STATUSES, elapsed)
+        metrics.observe_upstream(self.name, method, response.status_code, elapsed)
+        return response
+
+    def unavailable(self, error):
+        """The 503 returned in place of a failed or refused call"""
+        if isinstance(error, CircuitOpen):
+            response = jsonify({'error': f'Service unavailable: {self.name} is failing, try again shortly'})
+            response.headers['Retry-After'] = str(math.ceil(self.breaker.retry_after()) or 1)
+            return response, 503
+        if isinstance(error, Overloaded):
+            response = jsonify({'error': f'Service unavailable: {self.name} is overloaded, try again shortly'})
+            response.headers['Retry-After'] = retry_after_header(error.retry_after)
+            return response, 503
+        return jsonify({'error': f'Service unavailable: {str(error)}'}), 503
+
+    def forward(self, path, method=None):
+        """Forward the current Flask request and stream the response back untouched"""
+        method = method or request.method
+        headers = {
+            name: request.headers[name]
+            for name in FORWARDED_REQUEST_HEADERS
+            if name in request.headers
+        }
+        request_id = metrics.request_id()
+        if request_id:
+            headers[metrics.REQUEST_ID_HEADER] = request_id
+
+        try:
+            upstream = self.call(
+                method, path,
+                headers=headers,
+                data=request_body(method),
+                query_string=request.query_string,
+            )
+        except (CircuitOpen, Overloaded) as e:
+            return self.unavailable(e)
+        except requests.exceptions.RequestException as e:
+            print(f"[{request_id}] {self.name} upstream failed: {e}")
+            return self.unavailable(e)
+
+        return stream_response(upstream)
+
+
+def request_body(method):
+    """Body of the current request, buffered if small and streamed otherwise"""
+    if method in ('GET', 'HEAD', 'DELETE', 'OPTIONS'):
+        return None
+
+    length = request.content_length
+    if length is not None and length <= BUFFERED_BODY_LIMIT:
+        return request.get_data(cache=False)
+
+    stream = request.stream
+    return iter(lambda: stream.read(CHUNK_SIZE), b'')
+
+
+def stream_response(upstream):
+    """Relay an upstream ``requests`` response byte-for-byte"""
+    headers = [
+        (name, value) for name, value in upstream.raw.headers.items()
+        if name.lower() not in EXCLUDED_RESPONSE_HEADERS
+    ]
+
+    def generate():
+        try:
+            yield from upstream.raw.stream(CHUNK_SIZE, decode_content=False)
+        finally:
+            upstream.close()
+
+    response = Response(generate(), status=upstream.status_code, headers=headers)
+    # Response() adds its own default Content-Type; keep the upstream one
+    if 'Content-Type' not in upstream.headers:
+        del response.headers['Content-Type']
+    response.call_on_close(upstream.close)
+    return response
@@ -3,13 +3,21 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import jwt
 import datetime
-import hashlib
 import os
-import psycopg2
+import sys
+import time
 from psycopg2.extras import RealDictCursor
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import metrics, profiling, timing
+from common.db_pool import pool_from_env
+from passwords import DUMMY_HASH, HashingBusy, HashingPool
+
 app = Flask(__name__)
 CORS(app)
+timing.init_app(app, 'auth')
+metrics.init_app(app, 'auth')
+profiling.init_app(app, 'auth')
 
 # Configuration
 SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
@@ -22,45 +30,100 @@ TEST_CREDENTIALS = {
     'demo': 'demo123'
 }
 
+db_pool = pool_from_env(DATABASE_URL, connection_factory=metrics.TimedConnection)
+
 def get_db_connection():
-    """Get database connection with error handling"""
+    """Check out a pooled database connection with error handling"""
+    timing.begin('db')
+    started = time.perf_counter()
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
+        conn = db_pool.getconn()
     except Exception as e:
-        print(f"Database connection failed: {e}")
+        metrics.observe_checkout(time.perf_counter() - started, failed=True)
+        print(f"[{metrics.request_id()}] Database connection failed: {e}")
         return None
+    metrics.observe_checkout(time.perf_counter() - started)
+    return conn
+
+def release_db_connection(conn):
+    """Return a connection to the pool"""
+    db_pool.putconn(conn)
+    timing.end('db')
+
+hashing_pool = HashingPool()
 
 def hash_password(password):
-    """Hash password using SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash password with scrypt in the hashing pool"""
+    with timing.timed('hash'):
+        return hashing_pool.hash(password)
+
+def busy_response():
+    return jsonify({'error': 'Authentication is busy, please retry shortly'}), 503, {'Retry-After': '1'}
 
 def verify_test_credentials(username, password):
     """Verify against test credentials"""
     return username in TEST_CREDENTIALS and TEST_CREDENTIALS[username] == password
 
 def verify_db_credentials(username, password):
-    """Verify against database credentials"""
+    """Verify against database credentials, upgrading legacy hashes on success"""
     conn = get_db_connection()
     if not conn:
         return False
     
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        hashed_password = hash_password(password)
-        
         cur.execute(
-            "SELECT id, username, email FROM users WHERE username = %s AND password = %s",
-            (username, hashed_password)
+            "SELECT id, username, email, password FROM users WHERE username = %s",
+            (username,)
         )
         user = cur.fetchone()
         cur.close()
-        conn.close()
-        
-        return dict(user) if user else None
     except Exception as e:
         print(f"Database query failed: {e}")
         return False
+    finally:
+        release_db_connection(conn)
+    
+    if not user:
+        # Same scrypt work as a wrong password, so timing doesn't reveal which usernames exist
+        with timing.timed('hash'):
+            hashing_pool.verify(password, DUMMY_HASH)
+        return None
+    
+    # KDF work runs after the connection has gone back to the pool
+    user = dict(user)
+    with timing.timed('hash'):
+        matches, needs_rehash = hashing_pool.verify(password, user.pop('password'))
+    if not matches:
+        return None
+    
+    if needs_rehash:
+        rehash_password(user['id'], password)
+    return user
+
+def rehash_password(user_id, password):
+    """Replace a legacy or outdated hash after a successful login"""
+    try:
+        hashed_password = hash_password(password)
+    except HashingBusy:
+        return  # Try again on the next login
+    
+    conn = get_db_connection()
+    if not conn:
+        return
+    
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE users SET password = %s, updated_at = %s WHERE id = %s",
+            (hashed_password, datetime.datetime.utcnow(), user_id)
+        )
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print(f"Password rehash failed: {e}")
+    finally:
+        release_db_connection(conn)
 
 @app.route('/login', methods=['POST'])
 def login():
@@ -113,6 +176,8 @@ def login():
         
         return jsonify({'error': 'Invalid credentials'}), 401
         
+    except HashingBusy:
+        return busy_response()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -127,13 +192,14 @@ def register():
         if not username or not password or not email:
             return jsonify({'error': 'Username, password, and email required'}), 400
         
+        hashed_password = hash_password(password)
+        
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': 'Database not available. Try test credentials instead.'}), 503
         
         try:
             cur = conn.cursor()
-            hashed_password = hash_password(password)
             
             # Check if user exists
             cur.execute("SELECT id FROM users WHERE username = %s OR email = %s", (username, email))
@@ -167,8 +233,10 @@ def register():
             
         finally:
             cur.close()
-            conn.close()
+            release_db_connection(conn)
             
+    except HashingBusy:
+        return busy_response()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -189,7 +257,12 @@ def verify_token():
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({'status': 'healthy', 'service': 'auth-service'})
+    return jsonify({
+        'status': 'healthy',
+        'service': 'auth-service',
+        'db_pool': db_pool.stats(),
+        'password_hashing': hashing_pool.stats()
+    })
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    app.run(host='0.0.0.0', port=5001, debug=os.getenv('FLASK_DEBUG') == '1')
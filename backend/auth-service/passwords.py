@@ -0,0 +1,160 @@
+"""Password hashing with scrypt, run off the request threads.
+
+KDF work is submitted to a bounded process pool so a burst of logins can't
+tie up every request worker. When more than ``workers + queue_depth``
+hashes are in flight new requests are refused with ``HashingBusy`` and the
+caller answers 503 instead of queueing without limit.
+
+Each server worker process has its own pool and limit, so service-wide
+there are ``WEB_CONCURRENCY`` times as many hashing processes, each using
+about ``128 * r * n`` bytes (16 MiB at the defaults) while it hashes. The
+pool size therefore defaults to the cores divided among the server workers,
+at least one each.
+
+Stored format: ``scrypt$<n>$<r>$<p>$<salt>$<hash>`` (base64 salt and hash).
+Rows still holding the legacy unsalted SHA-256 hex digest verify as before
+and report that they need rehashing.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+SCRYPT_N = int(os.getenv('SCRYPT_N', str(2 ** 14)))
+SCRYPT_R = int(os.getenv('SCRYPT_R', '8'))
+SCRYPT_P = int(os.getenv('SCRYPT_P', '1'))
+SALT_BYTES = 16
+KEY_BYTES = 64
+
+
+def _default_pool_size():
+    server_workers = int(os.getenv('WEB_CONCURRENCY') or 1)
+    return max((os.cpu_count() or 1) // server_workers, 1)
+
+
+HASH_POOL_SIZE = int(os.getenv('HASH_POOL_SIZE') or _default_pool_size())
+HASH_QUEUE_DEPTH = int(os.getenv('HASH_QUEUE_DEPTH', '32'))
+HASH_TIMEOUT = float(os.getenv('HASH_TIMEOUT', '5'))
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool is saturated"""
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p,
+        maxmem=256 * r * (n + p + 2), dklen=KEY_BYTES
+    )
+
+
+def hash_password(password, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    """Hash a password with a fresh salt (runs in the calling process)"""
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(password, salt, n, r, p)
+    return 'scrypt${}${}${}${}${}'.format(
+        n, r, p, base64.b64encode(salt).decode(), base64.b64encode(key).decode()
+    )
+
+
+# Verified in place of a missing user's hash, so unknown usernames take as
+# long to reject as wrong passwords. The key is random, so nothing matches it.
+DUMMY_HASH = 'scrypt${}${}${}${}${}'.format(
+    SCRYPT_N, SCRYPT_R, SCRYPT_P,
+    base64.b64encode(os.urandom(SALT_BYTES)).decode(), base64.b64encode(os.urandom(KEY_BYTES)).decode()
+)
+
+
+def is_legacy_hash(stored):
+    return len(stored) == 64 and all(c in '0123456789abcdef' for c in stored)
+
+
+def verify_password(password, stored, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    """Return ``(matches, needs_rehash)`` for a stored hash"""
+    if is_legacy_hash(stored):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored), True
+
+    try:
+        scheme, stored_n, stored_r, stored_p, salt, key = stored.split('$')
+        if scheme != 'scrypt':
+            return False, False
+        stored_n, stored_r, stored_p = int(stored_n), int(stored_r), int(stored_p)
+        salt, key = base64.b64decode(salt), base64.b64decode(key)
+    except ValueError:
+        return False, False
+
+    candidate = _scrypt(password, salt, stored_n, stored_r, stored_p)
+    matches = hmac.compare_digest(candidate, key)
+    return matches, (stored_n, stored_r, stored_p) != (n, r, p)
+
+
+class HashingPool:
+    """Run KDF calls in worker processes with a cap on queued work.
+
+    ``workers=0`` hashes inline on the request thread, which is useful for
+    comparison benchmarks and single-process development.
+    """
+
+    def __init__(self, workers=HASH_POOL_SIZE, queue_depth=HASH_QUEUE_DEPTH, timeout=HASH_TIMEOUT):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_depth)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stats = {'submitted': 0, 'rejected': 0, 'timeouts': 0, 'in_flight': 0}
+
+    def _get_executor(self):
+        # Created lazily so forked server workers each get their own pool
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise HashingBusy('Password hashing queue is full')
+
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._stats['in_flight'] += 1
+        try:
+            if self.workers == 0:
+                return fn(*args)
+            future = self._get_executor().submit(fn, *args)
+            try:
+                return future.result(self.timeout)
+            except FutureTimeout:
+                future.cancel()
+                with self._lock:
+                    self._stats['timeouts'] += 1
+                raise HashingBusy('Password hashing timed out')
+        finally:
+            with self._lock:
+                self._stats['in_flight'] -= 1
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(hash_password, password)
+
+    def verify(self, password, stored):
+        return self._run(verify_password, password, stored)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({'workers': self.workers, 'queue_depth': self.queue_depth})
+        return stats
@@ -0,0 +1,71 @@
+"""Size and CPU cost of compressing expense list responses at the gateway.
+
+Builds the ``/expenses?limit=N`` body that finance-service sends, then, for
+each encoding api-gateway/compression.py can use, reports:
+
+  ratio      identity bytes / compressed bytes
+  cpu ms     median CPU time to compress one body
+  cached ms  median time to answer the same read from the compressed cache
+
+brotli and zstandard are skipped when they are not installed.
+
+    python benchmarks/compression.py --rows 50 500 5000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api-gateway'))
+from flask import Flask, Response, request
+from json_encoding import row_path, wire_rows
+
+import compression
+
+
+def timed(fn, runs, clock=time.thread_time):
+    fn()
+    latencies = []
+    for _ in range(runs):
+        started = clock()
+        fn()
+        latencies.append(clock() - started)
+    latencies.sort()
+    return latencies[len(latencies) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[50, 500, 5000])
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    app = Flask('compression')
+    encodings = compression.available_encodings()
+    print(f"encodings: {', '.join(encodings)}  levels: {compression.LEVELS}")
+    print(f"{'rows':>6} {'encoding':<9} {'bytes':>9} {'ratio':>7} {'cpu ms':>8} {'MB/s':>7} {'cached ms':>10}")
+    for count in args.rows:
+        body = row_path(wire_rows(count, args.seed))
+        print(f"{count:>6} {'identity':<9} {len(body):>9}")
+        for encoding in encodings:
+            compressed = compression.CODECS[encoding](body)
+            seconds = timed(lambda: compression.CODECS[encoding](body), args.runs)
+
+            compressor = compression.Compressor(encodings=[encoding], min_size=0)
+
+            def cached_read():
+                response = Response(body, mimetype='application/json')
+                response.set_etag('bench')
+                compressor.process(request, response, user='bench')
+
+            with app.test_request_context(headers={'Accept-Encoding': encoding}):
+                cached = timed(cached_read, args.runs, time.perf_counter)
+            print(f"{'':>6} {encoding:<9} {len(compressed):>9} {len(body) / len(compressed):>6.1f}x "
+                  f"{seconds * 1000:>8.3f} {len(body) / seconds / 1e6:>7.0f} {cached * 1000:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""Expense search latency against a user with a large ledger.
+
+Seeds one user with --rows expenses (1M by default) and some other users
+with smaller ledgers. It then runs each search --runs times with the same
+SQL finance-service uses (finance-service/search.py) and reports the query
+latency and the indexes the plan used. Two baselines show what search
+replaces: an unindexed ILIKE scan, and fetching the user's whole list.
+
+    python benchmarks/expense_search.py --pgserver
+    python benchmarks/expense_search.py --database-url postgresql://... --init-schema --rows 200000
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from load_test import init_schema, percentile, start_pgserver
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'finance-service'))
+import search
+from pagination import RECORD_COLUMNS
+
+MERCHANTS = [
+    'Uber ride', 'Uber Eats order', 'Lyft ride', 'Starbucks coffee', 'Whole Foods groceries',
+    'Trader Joes groceries', 'Amazon order', 'Netflix subscription', 'Spotify subscription',
+    'Shell gas station', 'Chevron gas', 'Rent payment', 'Electric bill', 'Water bill',
+    'Airbnb stay', 'Delta flight', 'Pharmacy', 'Gym membership', 'Restaurant dinner', 'Bookstore',
+]
+CATEGORIES = ['Food', 'Transportation', 'Housing', 'Utilities', 'Entertainment', 'Shopping', 'Travel', 'Health']
+
+SEED_SQL = """
+    INSERT INTO expenses (user_id, amount, description, category, date)
+    SELECT %(user_id)s,
+           round((random() * 200)::numeric, 2),
+           CASE WHEN random() < 0.0005 THEN 'Tesla supercharger'
+                ELSE (%(merchants)s::text[])[1 + floor(random() * %(merchant_count)s)::int]
+           END || ' #' || n,
+           (%(categories)s::text[])[1 + floor(random() * %(category_count)s)::int],
+           current_date - floor(random() * 3650)::int
+    FROM generate_series(1, %(rows)s) AS n
+"""
+
+
+def seed(conn, rows, other_users, other_rows):
+    cur = conn.cursor()
+    user_ids = []
+    for i in range(other_users + 1):
+        cur.execute(
+            "INSERT INTO users (username, email, password) VALUES (%s, %s, 'x') RETURNING id",
+            (f'search-bench-{time.time_ns()}-{i}', f'search-bench-{time.time_ns()}-{i}@bench.invalid')
+        )
+        user_ids.append(cur.fetchone()[0])
+
+    for i, user_id in enumerate(user_ids):
+        cur.execute(SEED_SQL, {
+            'user_id': user_id,
+            'rows': rows if i == 0 else other_rows,
+            'merchants': MERCHANTS, 'merchant_count': len(MERCHANTS),
+            'categories': CATEGORIES, 'category_count': len(CATEGORIES),
+        })
+    conn.commit()
+    conn.autocommit = True
+    cur.execute("VACUUM ANALYZE expenses")
+    conn.autocommit = False
+    return user_ids[0]
+
+
+def plan_indexes(plan):
+    names = set()
+    if 'Index Name' in plan:
+        names.add(plan['Index Name'])
+    for child in plan.get('Plans', []):
+        names |= plan_indexes(child)
+    return names
+
+
+def timed(conn, sql, params, runs):
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        cur.execute(sql, params)
+        cur.fetchall()
+        latencies.append(time.perf_counter() - started)
+    cur.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    plan = cur.fetchone()['QUERY PLAN'][0]['Plan']
+    cur.close()
+    return sorted(latencies), rows, plan_indexes(plan)
+
+
+def search_case(user_id, runs, limit, pages=1, **args):
+    filters = search.parse_args(args)
+
+    def run(conn):
+        after = None
+        # Follow the cursor to the requested page so deep pages are measured
+        for _ in range(pages - 1):
+            sql, params = search.search_query(user_id, filters, limit, after)
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            cur.close()
+            if len(rows) <= limit:
+                break
+            page = search.search_page(rows, limit)
+            after = search.decode_cursor(page['next_cursor'])
+        return timed(conn, *search.search_query(user_id, filters, limit, after), runs)
+    return run
+
+
+def raw_case(sql, params, runs):
+    return lambda conn: timed(conn, sql, params, runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='throwaway database to seed')
+    parser.add_argument('--init-schema', action='store_true', help='apply init-db.sql to --database-url first')
+    parser.add_argument('--pgserver', action='store_true', help='start a temporary Postgres (pip install pgserver)')
+    parser.add_argument('--rows', type=int, default=1000000, help='expenses for the searched user')
+    parser.add_argument('--other-users', type=int, default=10)
+    parser.add_argument('--other-rows', type=int, default=20000, help='expenses per other user')
+    parser.add_argument('--runs', type=int, default=50, help='timed runs per query')
+    parser.add_argument('--limit', type=int, default=50, help='page size')
+    parser.add_argument('--output', help='also write the results as JSON')
+    args = parser.parse_args()
+    if not args.database_url and not args.pgserver:
+        parser.error('give --database-url or --pgserver')
+
+    workdir = tempfile.mkdtemp(prefix='finflow-search-')
+    pg = None
+    try:
+        database_url = args.database_url
+        if database_url and args.init_schema:
+            init_schema(database_url)
+        elif not database_url:
+            pg, database_url = start_pgserver(workdir)
+
+        conn = psycopg2.connect(database_url)
+        print(f"Seeding {args.rows} expenses (+{args.other_users} x {args.other_rows} for other users)...")
+        started = time.perf_counter()
+        user_id = seed(conn, args.rows, args.other_users, args.other_rows)
+        print(f"Seeded in {time.perf_counter() - started:.1f}s\n")
+
+        recent = (datetime.date.today() - datetime.timedelta(days=90)).isoformat()
+        runs, limit = args.runs, args.limit
+        cases = [
+            ('q=uber (common)', search_case(user_id, runs, limit, q='uber')),
+            ('q=uber eats', search_case(user_id, runs, limit, q='uber eats')),
+            ('q=tesla (rare)', search_case(user_id, runs, limit, q='tesla')),
+            ('q=starb (prefix)', search_case(user_id, runs, limit, q='starb')),
+            ('q=uber page 5', search_case(user_id, runs, limit, pages=5, q='uber')),
+            ('q=uber sort=date', search_case(user_id, runs, limit, q='uber', sort='date')),
+            ('q=tesla sort=date', search_case(user_id, runs, limit, q='tesla', sort='date')),
+            ('q=amazon 100-150', search_case(user_id, runs, limit, q='amazon', min='100', max='150')),
+            ('category, last 90d', search_case(user_id, runs, limit, category='Food', **{'from': recent})),
+            ('no filters', search_case(user_id, runs, limit)),
+            ('baseline ILIKE', raw_case(
+                f"SELECT {RECORD_COLUMNS['expenses']} FROM expenses WHERE user_id = %s AND description ILIKE %s "
+                "ORDER BY date DESC, id DESC LIMIT %s", (user_id, '%uber%', limit + 1), runs)),
+            ('baseline full list', raw_case(
+                f"SELECT {RECORD_COLUMNS['expenses']} FROM expenses WHERE user_id = %s ORDER BY date DESC, id DESC",
+                (user_id,), max(runs // 10, 3))),
+        ]
+
+        results = []
+        print(f"{'query':<22} {'rows':>6} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}  indexes")
+        for name, case in cases:
+            latencies, rows, indexes = case(conn)
+            result = {
+                'query': name,
+                'rows': len(rows),
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'max_ms': latencies[-1] * 1000,
+                'indexes': sorted(indexes),
+            }
+            results.append(result)
+            print(f"{name:<22} {result['rows']:>6} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+                  f"{result['max_ms']:>9.2f}  {', '.join(result['indexes']) or 'seq scan'}")
+        conn.close()
+    finally:
+        if pg:
+            pg.cleanup()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'rows': args.rows, 'runs': args.runs, 'limit': args.limit, 'results': results}, f, indent=2)
+        print(f"\nSaved {args.output}")
+
+
+if __name__ == '__main__':
+    main()
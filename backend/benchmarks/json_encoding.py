@@ -0,0 +1,132 @@
+"""Cost of turning a page of expense rows into a JSON response body.
+
+Starts from the column text psycopg2 receives from Postgres and times each
+way finance-service can produce the ``/expenses?limit=N`` body:
+
+  jsonify (stdlib)     psycopg2 parses amounts to Decimal and dates to date,
+                       then RealDictRow -> dict -> Flask's default provider.
+                       This is the path before common/fastjson.py.
+  jsonify (fastjson)   the same dicts through common.fastjson.JSONProvider
+                       (orjson when installed).
+  RowEncoder           tuple rows with raw NUMERIC/DATE/TIMESTAMP text,
+                       encoded by finance-service/rowjson.py.
+
+Every variant's output is checked against the stdlib body before timing.
+
+    python benchmarks/json_encoding.py --rows 500 5000 50000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+
+import psycopg2.extensions
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'finance-service'))
+from common import fastjson
+import rowjson
+
+Column = namedtuple('Column', 'name type_code')
+
+# SELECT RECORD_COLUMNS['expenses'] as psycopg2 describes it
+DESCRIPTION = [
+    Column('id', 23), Column('user_id', 23), Column('amount', rowjson.NUMERIC_OID),
+    Column('description', 25), Column('category', 1043), Column('date', rowjson.DATE_OID),
+    Column('created_at', rowjson.TIMESTAMP_OID),
+]
+# psycopg2's default casts for the columns wire_rows leaves as text
+CASTS = [
+    None, None, psycopg2.extensions.DECIMAL, None, None, psycopg2.extensions.PYDATE,
+    psycopg2.extensions.PYDATETIME,
+]
+
+DESCRIPTIONS = ['Uber ride', 'Whole Foods groceries', 'Rent payment', 'Netflix subscription', 'Café latte']
+CATEGORIES = ['Food', 'Transportation', 'Housing', 'Entertainment']
+
+
+def wire_rows(count, seed):
+    """Rows as Postgres sends them: ints parsed, everything else text"""
+    rng = random.Random(seed)
+    today = date.today()
+    rows = []
+    for i in range(count):
+        day = today - timedelta(days=rng.randrange(3650))
+        rows.append((
+            count - i, 1, f'{rng.uniform(1, 500):.2f}', f'{rng.choice(DESCRIPTIONS)} #{i}',
+            rng.choice(CATEGORIES), day.isoformat(),
+            f'{day.isoformat()} {rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}.{rng.randrange(10**6):06d}',
+        ))
+    return rows
+
+
+def dict_path(app, rows):
+    names = [column.name for column in DESCRIPTION]
+    records = []
+    for row in rows:
+        values = [value if cast is None else cast(value, None) for value, cast in zip(row, CASTS)]
+        records.append(dict(dict(zip(names, values))))
+    with app.app_context():
+        return app.json.response({'items': records, 'next_cursor': None}).get_data()
+
+
+def row_path(rows):
+    encoder = rowjson.RowEncoder(DESCRIPTION)
+    body = fastjson.encode_object({
+        'items': fastjson.Raw(fastjson.encode_array(encoder.encode_many(rows))), 'next_cursor': None
+    })
+    return (body + '\n').encode()
+
+
+def timed(fn, runs):
+    fn()
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return latencies[len(latencies) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[500, 5000, 50000])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    stdlib_app = Flask('stdlib')
+    stdlib_app.json = DefaultJSONProvider(stdlib_app)
+    fast_app = Flask('fastjson')
+    fast_app.json = fastjson.JSONProvider(fast_app)
+
+    print(f"orjson: {'yes' if fastjson.available() else 'no (stdlib fallback)'}")
+    print(f"{'rows':>7} {'path':<20} {'p50 ms':>9} {'us/row':>8} {'speedup':>8}")
+    for count in args.rows:
+        rows = wire_rows(count, args.seed)
+        expected = dict_path(stdlib_app, rows)
+        variants = [
+            ('jsonify (stdlib)', lambda: dict_path(stdlib_app, rows)),
+            ('jsonify (fastjson)', lambda: dict_path(fast_app, rows)),
+            ('RowEncoder', lambda: row_path(rows)),
+        ]
+        baseline = None
+        for name, fn in variants:
+            if json.loads(fn()) != json.loads(expected):
+                raise SystemExit(f'{name} output differs from jsonify')
+            seconds = timed(fn, args.runs)
+            baseline = baseline or seconds
+            print(f"{count:>7} {name:<20} {seconds * 1000:>9.2f} {seconds / count * 1e6:>8.2f} "
+                  f"{baseline / seconds:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,566 @@
+"""End-to-end load test for auth-service, finance-service and api-gateway.
+
+Starts the three services locally under serve.py, seeds users with expense,
+income and budget history, then drives a weighted mix of dashboard calls
+through the gateway at a fixed concurrency. The report gives RPS and
+p50/p95/p99 latency per route and per hop, and is saved as JSON:
+
+    client    round trip measured by the load generator
+    gateway   time spent in api-gateway, including the upstream call
+    auth, finance          time spent in the service
+    auth-db, finance-db    time holding a database connection
+    auth-hash              password hashing
+
+Service hops come from the ``Server-Timing`` headers enabled with
+SERVER_TIMING=1 (see common/timing.py).
+
+Database, in order of preference:
+
+    --database-url URL   a throwaway database (add --init-schema if it is empty)
+    --pgserver           a temporary Postgres from the ``pgserver`` package
+    (neither)            no database: the auth-service test users, with their
+                         history in finance-service's in-memory store. Finance
+                         then runs a single threaded worker that is never
+                         recycled, so every request sees the seeded data.
+
+Examples:
+
+    python benchmarks/load_test.py --pgserver --users 20 --history 2000 --duration 30
+    python benchmarks/load_test.py --mix list_expenses=80,budget=20 --concurrency 32
+    python benchmarks/load_test.py --pgserver --compare load-test-abc1234.json
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+DEFAULT_MIX = 'login=5,list_expenses=30,list_income=15,create_expense=15,budget=20,summary=15'
+
+CATEGORIES = ('Food', 'Transport', 'Housing', 'Utilities', 'Entertainment', 'Health')
+SOURCES = ('Salary', 'Freelance', 'Investments')
+
+# Stand-in mode: the auth-service test credentials, served from the in-memory store
+TEST_USERS = [('demo', 'demo123'), ('testuser', 'testpass123'), ('admin', 'admin123')]
+
+PERCENTILES = (50, 95, 99)
+
+
+# Workload
+
+def op_login(session, base_url, user, rng):
+    return session.post(f'{base_url}/api/auth/login',
+                        json={'username': user['username'], 'password': user['password']})
+
+
+def op_list_expenses(session, base_url, user, rng):
+    return session.get(f'{base_url}/api/finance/expenses', params={'limit': 50}, headers=user['headers'])
+
+
+def op_list_income(session, base_url, user, rng):
+    return session.get(f'{base_url}/api/finance/income', params={'limit': 50}, headers=user['headers'])
+
+
+def op_create_expense(session, base_url, user, rng):
+    expense = {
+        'amount': round(rng.uniform(1, 200), 2),
+        'description': 'load test',
+        'category': rng.choice(CATEGORIES),
+        'date': datetime.date.today().isoformat(),
+    }
+    return session.post(f'{base_url}/api/finance/expenses', json=expense, headers=user['headers'])
+
+
+def op_budget(session, base_url, user, rng):
+    return session.get(f'{base_url}/api/finance/budget', headers=user['headers'])
+
+
+def op_summary(session, base_url, user, rng):
+    return session.get(f'{base_url}/api/finance/reports/summary', headers=user['headers'])
+
+
+def op_dashboard_batch(session, base_url, user, rng):
+    # What list_expenses + list_income + budget fetch, in one round trip
+    return session.post(f'{base_url}/api/batch', headers=user['headers'], json={'requests': [
+        {'id': 'expenses', 'path': '/api/finance/expenses?limit=50'},
+        {'id': 'income', 'path': '/api/finance/income?limit=50'},
+        {'id': 'budget', 'path': '/api/finance/budget'},
+    ]})
+
+
+OPERATIONS = {
+    'login': op_login,
+    'list_expenses': op_list_expenses,
+    'list_income': op_list_income,
+    'create_expense': op_create_expense,
+    'budget': op_budget,
+    'summary': op_summary,
+    'dashboard_batch': op_dashboard_batch,
+}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_server_timing(header):
+    """``gateway;dur=1.2, finance;dur=0.8`` -> {'gateway': 1.2, 'finance': 0.8}"""
+    timings = {}
+    for entry in (header or '').split(','):
+        name, *params = entry.strip().split(';')
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'dur' and name:
+                timings[name] = timings.get(name, 0.0) + float(value)
+    return timings
+
+
+# Database
+
+def schema_sql():
+    with open(os.path.join(BACKEND_DIR, 'init-db.sql')) as f:
+        sql = f.read()
+    # Skip the CREATE DATABASE / \c preamble; the target database already exists
+    return sql.split('\\c finflow_db;', 1)[1]
+
+
+def init_schema(database_url):
+    import psycopg2
+
+    conn = psycopg2.connect(database_url)
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        # The schema grants to the application role, which may not exist here
+        cur.execute("""
+            DO $$ BEGIN
+                IF NOT EXISTS (SELECT FROM pg_roles WHERE rolname = 'finflow') THEN
+                    CREATE ROLE finflow LOGIN PASSWORD 'finflow123';
+                END IF;
+            END $$
+        """)
+        cur.execute(schema_sql())
+    finally:
+        conn.close()
+
+
+def start_pgserver(workdir):
+    try:
+        import pgserver
+    except ImportError:
+        raise SystemExit("--pgserver needs the pgserver package: pip install pgserver")
+
+    server = pgserver.get_server(os.path.join(workdir, 'pgdata'), cleanup_mode='stop')
+    try:
+        server.psql('CREATE DATABASE finflow_loadtest;')
+        database_url = server.get_uri('finflow_loadtest')
+        init_schema(database_url)
+    except Exception:
+        server.cleanup()
+        raise
+    return server, database_url
+
+
+def seed_budgets(database_url, user_ids):
+    import psycopg2
+    from psycopg2.extras import execute_values
+
+    rows = [(user_id, category, 500, 'monthly') for user_id in user_ids for category in CATEGORIES]
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, "INSERT INTO budgets (user_id, category, budgeted, period) VALUES %s", rows)
+            # Budget spend is maintained on write; backfill it for the seeded history
+            cur.execute("""
+                INSERT INTO budget_spend (budget_id, period_start, spent)
+                SELECT b.id, budget_period_start(b.period, e.date), SUM(e.amount)
+                FROM budgets b
+                JOIN expenses e ON e.user_id = b.user_id AND e.category = b.category
+                WHERE b.user_id = ANY(%s)
+                GROUP BY 1, 2
+                ON CONFLICT (budget_id, period_start) DO UPDATE SET spent = EXCLUDED.spent
+            """, (list(user_ids),))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# Services
+
+class Stack:
+    """auth-service, finance-service and api-gateway running under serve.py"""
+
+    def __init__(self, workdir, database_url, base_port, workers, asgi=False, in_memory=False):
+        self.workdir = workdir
+        self.ports = {'auth-service': base_port + 1, 'finance-service': base_port + 2, 'api-gateway': base_port}
+        self.env = dict(
+            os.environ,
+            DATABASE_URL=database_url,
+            SECRET_KEY=secrets.token_hex(16),
+            SERVER_TIMING='1',
+            ACCESS_LOG='',
+            AUTH_SERVICE_URL=f"http://127.0.0.1:{self.ports['auth-service']}",
+            FINANCE_SERVICE_URL=f"http://127.0.0.1:{self.ports['finance-service']}",
+            # A few simulated users drive all the load, so per-user limits are off unless asked for
+            RATE_LIMIT_ENABLED=os.getenv('RATE_LIMIT_ENABLED', '0'),
+        )
+        self.workers = workers
+        self.asgi = asgi
+        self.in_memory = in_memory
+        self.processes = {}
+
+    @property
+    def gateway_url(self):
+        return f"http://127.0.0.1:{self.ports['api-gateway']}"
+
+    def start(self, timeout=60):
+        for service, port in self.ports.items():
+            workers, env = self.workers, self.env
+            if self.in_memory and service == 'finance-service':
+                # The store is per process and a recycled worker starts empty
+                workers = 1
+                env = dict(env, MAX_REQUESTS='0', GUNICORN_THREADS=str(max(self.workers, 2) * 4))
+            argv = [
+                sys.executable, os.path.join(BACKEND_DIR, 'serve.py'), service,
+                '--port', str(port), '--workers', str(workers),
+                '--pidfile', os.path.join(self.workdir, f'{service}.pid'),
+            ]
+            if self.asgi and service == 'finance-service':
+                argv.append('--asgi')
+            log = open(os.path.join(self.workdir, f'{service}.log'), 'wb')
+            self.processes[service] = subprocess.Popen(argv, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+        deadline = time.monotonic() + timeout
+        for service, port in self.ports.items():
+            while True:
+                if self.processes[service].poll() is not None:
+                    raise SystemExit(f"{service} exited; see {self.workdir}/{service}.log")
+                try:
+                    if requests.get(f'http://127.0.0.1:{port}/health', timeout=1).ok:
+                        break
+                except requests.RequestException:
+                    pass
+                if time.monotonic() > deadline:
+                    raise SystemExit(f"{service} did not become healthy; see {self.workdir}/{service}.log")
+                time.sleep(0.2)
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+# Seeding
+
+def history_ndjson(rng, count, kind):
+    today = datetime.date.today()
+    lines = []
+    for _ in range(count):
+        record = {
+            'amount': round(rng.uniform(5, 500 if kind == 'expenses' else 3000), 2),
+            'date': (today - datetime.timedelta(days=rng.randrange(365))).isoformat(),
+        }
+        if kind == 'expenses':
+            record.update(description='seeded', category=rng.choice(CATEGORIES))
+        else:
+            record['source'] = rng.choice(SOURCES)
+        lines.append(json.dumps(record))
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def seed_history(base_url, user, history, rng):
+    for kind, rows in (('expenses', history), ('income', max(history // 4, 1))):
+        if not history:
+            break
+        response = requests.post(
+            f'{base_url}/api/finance/{kind}/bulk',
+            data=history_ndjson(rng, rows, kind),
+            headers=dict(user['headers'], **{'Content-Type': 'application/x-ndjson'}),
+        )
+        response.raise_for_status()
+
+
+def seed_users(base_url, database_url, count, history, rng):
+    if database_url is None:
+        users = [login_user(base_url, *credentials) for credentials in TEST_USERS[:max(count, 1)]]
+        for user in users:
+            seed_history(base_url, user, history, rng)
+        return users
+
+    run_id = secrets.token_hex(3)
+    users = []
+    for i in range(count):
+        username = f'load-{run_id}-{i}'
+        password = secrets.token_hex(8)
+        response = requests.post(f'{base_url}/api/auth/register', json={
+            'username': username, 'password': password, 'email': f'{username}@loadtest.invalid',
+        })
+        response.raise_for_status()
+        body = response.json()
+        user = {
+            'id': body['user']['id'],
+            'username': username,
+            'password': password,
+            'headers': {'Authorization': f"Bearer {body['token']}"},
+        }
+        seed_history(base_url, user, history, rng)
+        users.append(user)
+
+    seed_budgets(database_url, [user['id'] for user in users])
+    return users
+
+
+def login_user(base_url, username, password):
+    response = requests.post(f'{base_url}/api/auth/login', json={'username': username, 'password': password})
+    response.raise_for_status()
+    return {
+        'username': username,
+        'password': password,
+        'headers': {'Authorization': f"Bearer {response.json()['token']}"},
+    }
+
+
+# Load generation
+
+def drive(base_url, users, mix, concurrency, warmup, duration, seed):
+    """Run the mix from ``concurrency`` threads; returns samples after warm-up"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    started = time.monotonic()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+    samples = [[] for _ in range(concurrency)]
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        session = requests.Session()
+        out = samples[index]
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            name = rng.choices(names, weights)[0]
+            user = rng.choice(users)
+            request_started = time.perf_counter()
+            try:
+                response = OPERATIONS[name](session, base_url, user, rng)
+                response.content
+                status = response.status_code
+                timings = parse_server_timing(response.headers.get('Server-Timing'))
+            except requests.RequestException:
+                status, timings = 0, {}
+            elapsed_ms = (time.perf_counter() - request_started) * 1000
+            if now >= measure_from:
+                timings['client'] = elapsed_ms
+                out.append((name, status, timings))
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [sample for thread_samples in samples for sample in thread_samples]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def latency_summary(values):
+    values = sorted(values)
+    summary = {f'p{pct}': round(percentile(values, pct), 3) for pct in PERCENTILES}
+    summary['mean'] = round(sum(values) / len(values), 3)
+    summary['max'] = round(values[-1], 3)
+    summary['count'] = len(values)
+    return summary
+
+
+def summarize(samples, duration):
+    def group_summary(group):
+        hops = defaultdict(list)
+        statuses = defaultdict(int)
+        errors = 0
+        for _, status, timings in group:
+            statuses[str(status)] += 1
+            if not (200 <= status < 300 or status == 304):
+                errors += 1
+            for hop, ms in timings.items():
+                hops[hop].append(ms)
+        return {
+            'requests': len(group),
+            'errors': errors,
+            'rps': round(len(group) / duration, 2),
+            'status': dict(statuses),
+            'latency_ms': {hop: latency_summary(values) for hop, values in sorted(hops.items())},
+        }
+
+    by_route = defaultdict(list)
+    for sample in samples:
+        by_route[sample[0]].append(sample)
+    return {
+        'routes': {name: group_summary(group) for name, group in sorted(by_route.items())},
+        'total': group_summary(samples),
+    }
+
+
+# Reporting
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BACKEND_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def print_report(results):
+    hops = ('client', 'gateway', 'auth', 'finance', 'auth-db', 'finance-db', 'auth-hash')
+    print(f"\n{'route':<16}{'req':>8}{'err':>6}{'rps':>9}  {'hop':<11}{'p50':>9}{'p95':>9}{'p99':>9}")
+    rows = list(results['routes'].items()) + [('TOTAL', results['total'])]
+    for name, route in rows:
+        first = True
+        for hop in hops:
+            latency = route['latency_ms'].get(hop)
+            if not latency:
+                continue
+            prefix = (f"{name:<16}{route['requests']:>8}{route['errors']:>6}{route['rps']:>9.1f}"
+                      if first else ' ' * 39)
+            print(f"{prefix}  {hop:<11}{latency['p50']:>9.2f}{latency['p95']:>9.2f}{latency['p99']:>9.2f}")
+            first = False
+
+
+def print_comparison(results, baseline):
+    print(f"\nvs {baseline['meta'].get('git_commit')} ({baseline['meta'].get('timestamp')}):")
+    print(f"{'route':<16}{'rps':>18}{'client p95 ms':>24}")
+    rows = list(results['routes'].items()) + [('TOTAL', results['total'])]
+    for name, route in rows:
+        old = baseline['total'] if name == 'TOTAL' else baseline['routes'].get(name)
+        if not old:
+            continue
+        new_p95 = route['latency_ms'].get('client', {}).get('p95')
+        old_p95 = old['latency_ms'].get('client', {}).get('p95')
+        rps_delta = (route['rps'] / old['rps'] - 1) * 100 if old['rps'] else 0
+        p95_delta = (new_p95 / old_p95 - 1) * 100 if new_p95 and old_p95 else 0
+        print(f"{name:<16}{old['rps']:>8.1f} -> {route['rps']:<8.1f}"
+              f"{old_p95 or 0:>10.2f} -> {new_p95 or 0:<8.2f} ({rps_delta:+.1f}% rps, {p95_delta:+.1f}% p95)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='throwaway database for the services')
+    parser.add_argument('--init-schema', action='store_true', help='apply init-db.sql to --database-url first')
+    parser.add_argument('--pgserver', action='store_true', help='start a temporary Postgres (pip install pgserver)')
+    parser.add_argument('--users', type=int, default=10, help='users to register and seed')
+    parser.add_argument('--history', type=int, default=500, help='expenses per user (income is a quarter of this)')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'weighted operations (default: {DEFAULT_MIX})')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--warmup', type=float, default=5, help='seconds before measuring')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to measure')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers per service')
+    parser.add_argument('--asgi', action='store_true', help='run finance-service on its ASGI entry point')
+    parser.add_argument('--base-port', type=int, default=18000, help='gateway port; services use the next two')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='results file (default: load-test-COMMIT-TIMESTAMP.json)')
+    parser.add_argument('--compare', help='earlier results file to diff against')
+    parser.add_argument('--keep-logs', action='store_true', help='keep the service logs directory')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='finflow-loadtest-')
+    pg = None
+    stack = None
+    try:
+        database_url = args.database_url
+        if database_url and args.init_schema:
+            init_schema(database_url)
+        elif not database_url and args.pgserver:
+            pg, database_url = start_pgserver(workdir)
+
+        # Without a database the services answer test users from the in-memory store
+        stack = Stack(workdir, database_url or 'postgresql://loadtest@127.0.0.1:1/none',
+                      args.base_port, args.workers, args.asgi, in_memory=not database_url)
+        print(f"Starting services ({'database' if database_url else 'in-memory stand-in'}), logs in {workdir}")
+        stack.start()
+
+        rng = random.Random(args.seed)
+        print(f"Seeding {args.users if database_url else min(args.users, len(TEST_USERS))} users...")
+        users = seed_users(stack.gateway_url, database_url, args.users, args.history, rng)
+
+        print(f"Running {args.concurrency} clients for {args.warmup:g}s warm-up + {args.duration:g}s...")
+        samples = drive(stack.gateway_url, users, args.mix, args.concurrency,
+                        args.warmup, args.duration, args.seed)
+    finally:
+        if stack:
+            stack.stop()
+        if pg:
+            pg.cleanup()
+        if args.keep_logs:
+            print(f"Service logs kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    commit, dirty = git_revision()
+    timestamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    results = {
+        'meta': {
+            'timestamp': timestamp,
+            'git_commit': commit,
+            'git_dirty': dirty,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'database': 'external' if args.database_url else 'pgserver' if args.pgserver else 'stand-in',
+            'args': {k: v for k, v in vars(args).items() if k not in ('database_url', 'compare', 'output')},
+        },
+        **summarize(samples, args.duration),
+    }
+
+    print_report(results)
+    output = args.output or f'load-test-{commit or "unknown"}-{timestamp}.json'
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"\nSaved {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+
+    return 0 if results['total']['errors'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
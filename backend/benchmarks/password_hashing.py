@@ -0,0 +1,124 @@
+"""Login throughput and latency for different scrypt costs and pool layouts.
+
+Each simulated login verifies a password through auth-service's
+HashingPool, exactly as the /login handler does (minus the DB lookup).
+Like gunicorn, every configuration forks ``--server-workers`` processes.
+Each has its own HashingPool and ``--threads`` request threads logging in
+back to back. Pool size 0 hashes inline on the request thread for
+comparison; ``auto`` is auth-service's default of cores / server workers.
+
+    python benchmarks/password_hashing.py --costs 14 --server-workers 1 9 --pools 0 auto 4 --threads 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'auth-service'))
+from passwords import HashingBusy, HashingPool, hash_password
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(pool, stored, concurrency, logins):
+    latencies = []
+    rejected = [0]
+    lock = threading.Lock()
+    per_thread = max(logins // concurrency, 1)
+
+    def worker():
+        for _ in range(per_thread):
+            started = time.perf_counter()
+            try:
+                pool.verify('correct horse battery staple', stored)
+            except HashingBusy:
+                with lock:
+                    rejected[0] += 1
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return len(latencies) / elapsed, latencies, rejected[0]
+
+
+def server_worker(pool_size, queue_depth, stored, threads, logins, ready, results):
+    """One forked server worker: its own pool, ``threads`` concurrent logins"""
+    pool = HashingPool(workers=pool_size, queue_depth=queue_depth, timeout=60)
+    try:
+        pool.verify('warm up', stored)
+        ready.wait()
+        started = time.perf_counter()
+        _, latencies, rejected = run(pool, stored, threads, logins)
+        results.put((started, time.perf_counter(), latencies, rejected))
+    finally:
+        pool.shutdown()
+
+
+def run_layout(server_workers, pool_size, queue_depth, stored, threads, logins):
+    """Fork the server workers, start them together and combine their results"""
+    ctx = multiprocessing.get_context('fork')
+    ready = ctx.Barrier(server_workers)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=server_worker, args=(
+            pool_size, queue_depth, stored, threads, max(logins // server_workers, threads), ready, results
+        ))
+        for _ in range(server_workers)
+    ]
+    for process in processes:
+        process.start()
+    finished = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies = [latency for _, _, worker_latencies, _ in finished for latency in worker_latencies]
+    elapsed = max(end for _, end, _, _ in finished) - min(start for start, _, _, _ in finished)
+    return len(latencies) / elapsed, latencies, sum(rejected for _, _, _, rejected in finished)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--costs', type=int, nargs='+', default=[14, 15], help='scrypt log2(N) values')
+    parser.add_argument('--server-workers', type=int, nargs='+',
+                        default=[1, (os.cpu_count() or 1) * 2 + 1], help='gunicorn worker processes')
+    parser.add_argument('--pools', nargs='+', default=['0', 'auto', str(os.cpu_count() or 1)],
+                        help="hashing processes per server worker, or 'auto'")
+    parser.add_argument('--threads', type=int, default=4, help='request threads per server worker')
+    parser.add_argument('--logins', type=int, default=200, help='logins per configuration')
+    parser.add_argument('--queue-depth', type=int, default=1000)
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    print(f"{'N':>8} {'servers':>8} {'pool':>5} {'hashers':>8} {'logins/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'rejected':>9}")
+    for cost in args.costs:
+        n = 2 ** cost
+        stored = hash_password('correct horse battery staple', n=n)
+        for server_workers in args.server_workers:
+            for pool in args.pools:
+                pool_size = max(cpus // server_workers, 1) if pool == 'auto' else int(pool)
+                rate, latencies, rejected = run_layout(
+                    server_workers, pool_size, args.queue_depth, stored, args.threads, args.logins
+                )
+                print(f"{n:>8} {server_workers:>8} {pool_size:>5} {server_workers * pool_size:>8} {rate:>10.1f} "
+                      f"{percentile(latencies, 50) * 1000:>9.1f} {percentile(latencies, 99) * 1000:>9.1f} "
+                      f"{rejected:>9}")
+
+
+if __name__ == '__main__':
+    main()
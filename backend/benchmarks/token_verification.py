@@ -0,0 +1,69 @@
+"""Compare per-request token verification cost with and without the cache.
+
+Simulates a stream of authenticated requests from a pool of active users
+(each user reuses their token across many requests, as the dashboard does)
+and reports the average cost of verifying one request's token.
+
+    python benchmarks/token_verification.py --users 500 --requests 200000
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+import jwt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.tokens import TokenVerifier
+
+SECRET_KEY = 'benchmark-secret'
+
+
+def make_tokens(count):
+    exp = datetime.datetime.utcnow() + datetime.timedelta(hours=24)
+    return [
+        jwt.encode({'user_id': i, 'username': f'user{i}', 'exp': exp, 'type': 'db'},
+                   SECRET_KEY, algorithm='HS256')
+        for i in range(count)
+    ]
+
+
+def run(label, verify, stream):
+    started = time.perf_counter()
+    for token in stream:
+        verify(token)
+    elapsed = time.perf_counter() - started
+    per_request_us = elapsed / len(stream) * 1e6
+    print(f"{label:<22} {per_request_us:8.2f} us/request  {len(stream) / elapsed:12.0f} verifications/s")
+    return per_request_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500, help='distinct active tokens')
+    parser.add_argument('--requests', type=int, default=100000, help='verifications to run')
+    parser.add_argument('--cache-size', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    tokens = make_tokens(args.users)
+    stream = [random.choice(tokens) for _ in range(args.requests)]
+
+    def uncached(token):
+        return jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+
+    verifier = TokenVerifier(SECRET_KEY, max_entries=args.cache_size)
+
+    print(f"{args.requests} requests from {args.users} users")
+    before = run('jwt.decode', uncached, stream)
+    after = run('TokenVerifier.verify', verifier.verify, stream)
+    print(f"speedup: {before / after:.1f}x")
+    print(f"cache: {verifier.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the timeout"""
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections.
+
+    Connections are validated before being handed out when they have been
+    idle for longer than ``validate_after`` seconds, and are recycled once
+    they have served ``max_uses`` checkouts or are older than
+    ``max_lifetime`` seconds. ``connection_factory`` is passed through to
+    ``psycopg2.connect``.
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=5.0,
+                 max_uses=1000, max_lifetime=1800.0, validate_after=30.0,
+                 connection_factory=None):
+        self.dsn = dsn
+        self.connection_factory = connection_factory
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.timeout = timeout
+        self.max_uses = max_uses
+        self.max_lifetime = max_lifetime
+        self.validate_after = validate_after
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._meta = {}
+        self._size = 0
+        self._waiting = 0
+        self._stats = {
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'connections_recycled': 0,
+            'connections_discarded': 0,
+            'checkouts': 0,
+            'checkout_timeouts': 0,
+            'checkout_time_total_ms': 0.0,
+            'checkout_time_max_ms': 0.0,
+        }
+        self._filled = False
+
+    def _connect(self):
+        """Open a new connection for a slot already reserved in ``_size``"""
+        try:
+            conn = psycopg2.connect(self.dsn, connection_factory=self.connection_factory)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        now = time.monotonic()
+        with self._cond:
+            self._meta[id(conn)] = {'created': now, 'last_used': now, 'uses': 0}
+            self._stats['connections_opened'] += 1
+        return conn
+
+    def _close(self, conn):
+        # Caller must hold the lock
+        self._meta.pop(id(conn), None)
+        self._size -= 1
+        self._stats['connections_closed'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _fill(self):
+        """Open ``min_size`` connections the first time the pool is used"""
+        with self._cond:
+            if self._filled:
+                return
+            self._filled = True
+            missing = max(self.min_size - self._size, 0)
+            self._size += missing
+        for opened in range(missing):
+            try:
+                conn = self._connect()
+            except Exception:
+                # _connect gave back its own slot; give back the ones not tried
+                # yet and let the next checkout fill again
+                with self._cond:
+                    self._size -= missing - opened - 1
+                    self._filled = False
+                    self._cond.notify_all()
+                raise
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def _validate(self, conn):
+        """Return None if the connection can be reused, else the stat to bump"""
+        if conn.closed:
+            return 'connections_discarded'
+        meta = self._meta[id(conn)]
+        now = time.monotonic()
+        if now - meta['created'] >= self.max_lifetime:
+            return 'connections_recycled'
+        if now - meta['last_used'] < self.validate_after:
+            return None
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return None
+        except Exception:
+            return 'connections_discarded'
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting up to ``timeout`` seconds"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        if not self._filled:
+            self._fill()
+
+        while True:
+            conn = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['checkout_timeouts'] += 1
+                        raise PoolTimeout(
+                            f'No database connection available after {timeout}s'
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+                if self._idle:
+                    conn = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if conn is None:
+                conn = self._connect()
+                with self._cond:
+                    return self._checked_out(conn, started)
+
+            # Validation may hit the network, so it runs outside the lock
+            problem = self._validate(conn)
+            with self._cond:
+                if problem is None:
+                    return self._checked_out(conn, started)
+                self._stats[problem] += 1
+                self._close(conn)
+                self._cond.notify()
+
+    def _checked_out(self, conn, started):
+        meta = self._meta[id(conn)]
+        meta['uses'] += 1
+        elapsed_ms = (time.monotonic() - started) * 1000
+        self._stats['checkouts'] += 1
+        self._stats['checkout_time_total_ms'] += elapsed_ms
+        self._stats['checkout_time_max_ms'] = max(self._stats['checkout_time_max_ms'], elapsed_ms)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool, rolling back any open transaction"""
+        if conn is None:
+            return
+
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            meta = self._meta.get(id(conn))
+            if meta is None:
+                # Not one of ours (or already closed by the pool)
+                return
+            meta['last_used'] = time.monotonic()
+
+            if discard or conn.closed:
+                self._stats['connections_discarded'] += 1
+                self._close(conn)
+            elif (meta['uses'] >= self.max_uses
+                  or meta['last_used'] - meta['created'] >= self.max_lifetime):
+                self._stats['connections_recycled'] += 1
+                self._close(conn)
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def connection(self, timeout=None):
+        """Context manager that checks a connection out and returns it"""
+        return _PooledConnection(self, timeout)
+
+    def closeall(self):
+        """Close every idle connection and allow the pool to refill"""
+        with self._cond:
+            while self._idle:
+                self._close(self._idle.pop())
+            self._filled = False
+
+    def stats(self):
+        """Snapshot of pool usage for the health endpoint"""
+        with self._cond:
+            stats = dict(self._stats)
+            checkouts = stats['checkouts']
+            total_ms = stats.pop('checkout_time_total_ms')
+            stats['checkout_time_avg_ms'] = round(total_ms / checkouts, 3) if checkouts else 0.0
+            stats['checkout_time_max_ms'] = round(stats['checkout_time_max_ms'], 3)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'waiting': self._waiting,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            })
+            return stats
+
+
+class _PooledConnection:
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = self.pool.getconn(self.timeout)
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.pool.putconn(self.conn)
+        return False
+
+
+def pool_from_env(dsn, **kwargs):
+    """Build a pool configured from the DB_POOL_* environment variables"""
+    return ConnectionPool(
+        dsn,
+        min_size=int(os.getenv('DB_POOL_MIN_SIZE', '1')),
+        max_size=int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+        timeout=float(os.getenv('DB_POOL_TIMEOUT', '5')),
+        max_uses=int(os.getenv('DB_POOL_MAX_USES', '1000')),
+        max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', '1800')),
+        validate_after=float(os.getenv('DB_POOL_VALIDATE_AFTER', '30')),
+        **kwargs
+    )
@@ -0,0 +1,117 @@
+"""JSON encoding shared by the Flask services, using orjson when it is installed.
+
+``dumps`` produces what Flask's default provider does: sorted keys, dates
+as HTTP dates and ``Decimal`` as a string. orjson does the work when it is
+importable. Otherwise, or for anything orjson refuses (integers beyond 64
+bits, non-string keys), the standard library encoder is used.
+
+One difference remains: orjson writes non-ASCII characters as UTF-8 where
+the standard library escapes them (``"café"`` vs ``"caf\\u00e9"``). Both
+decode to the same value.
+
+``JSONProvider`` installs this as ``app.json``, so ``jsonify`` uses it.
+``Raw`` marks JSON that is already encoded, such as an upstream response
+body or rows from ``rowjson``, so ``encode_object`` can splice it in
+without parsing it again.
+"""
+
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('', 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def available():
+    """Whether orjson is doing the encoding"""
+    return orjson is not None
+
+
+def http_date(value):
+    """Format a date or datetime like ``werkzeug.http.http_date`` (naive means UTC)"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return (f'{_DAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month]} {value.year:04d} '
+                f'{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT')
+    return f'{_DAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month]} {value.year:04d} 00:00:00 GMT'
+
+
+def _default(o):
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, Decimal):
+        return str(o)
+    return DefaultJSONProvider.default(o)
+
+
+def _stdlib_dumps(obj, **kwargs):
+    kwargs.setdefault('default', _default)
+    kwargs.setdefault('sort_keys', True)
+    return json.dumps(obj, **kwargs)
+
+
+def dumps(obj):
+    """Compact JSON text for ``obj``, encoded the way ``jsonify`` does"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode()
+        except TypeError:
+            pass
+    return _stdlib_dumps(obj, separators=(',', ':'))
+
+
+def loads(s):
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)
+
+
+class Raw(str):
+    """Text that is already JSON; ``encode_object`` inserts it unchanged"""
+
+
+def encode_object(fields):
+    """JSON object text for ``fields``, with sorted keys; ``Raw`` values are spliced in"""
+    return '{' + ','.join(
+        f'{json.dumps(key)}:{value if isinstance(value, Raw) else dumps(value)}'
+        for key, value in sorted(fields.items())
+    ) + '}'
+
+
+def encode_array(items):
+    """JSON array text for a sequence of ``Raw`` values"""
+    return '[' + ','.join(items) + ']'
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's default JSON provider with ``dumps`` above as the fast path"""
+
+    def dumps(self, obj, **kwargs):
+        # jsonify passes compact separators; anything else (debug indent,
+        # explicit options) keeps the standard library's behaviour
+        if orjson is not None and kwargs in ({}, {'separators': (',', ':')}):
+            return dumps(obj)
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = args[0] if len(args) == 1 and not kwargs else None
+        if isinstance(obj, Raw):
+            return self._app.response_class(f'{obj}\n', mimetype=self.mimetype)
+        return super().response(*args, **kwargs)
@@ -0,0 +1,253 @@
+"""Prometheus metrics and request IDs shared by the Flask services.
+
+``init_app(app, service)`` adds:
+
+* per-route request counts, latency histograms and 5xx error counts
+* an ``X-Request-ID`` on every request. It is taken from the incoming request
+  when valid, otherwise generated, and echoed on the response. The gateway
+  forwards it upstream, so the access logs of every hop share one ID.
+* ``GET /metrics`` in the Prometheus text format
+
+Database and upstream timings are recorded through ``TimedConnection``
+(pass it to the connection pool), ``observe_checkout`` and
+``observe_upstream``.
+
+Under gunicorn every worker writes to PROMETHEUS_MULTIPROC_DIR (set up by
+gunicorn.conf.py) and ``/metrics`` aggregates all of them.
+"""
+
+import os
+import re
+import time
+import uuid
+
+from flask import Response, g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+    generate_latest, multiprocess
+)
+
+try:
+    from psycopg2 import extensions
+except ImportError:  # api-gateway has no database
+    extensions = None
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+# Request latencies span sub-millisecond cache hits to multi-second imports
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+HTTP_REQUESTS = Counter(
+    'finflow_http_requests', 'HTTP requests handled',
+    ['service', 'method', 'route', 'status']
+)
+HTTP_LATENCY = Histogram(
+    'finflow_http_request_duration_seconds', 'Time to produce the response headers',
+    ['service', 'method', 'route'], buckets=LATENCY_BUCKETS
+)
+HTTP_ERRORS = Counter(
+    'finflow_http_errors', 'Requests that ended in a 5xx response',
+    ['service', 'method', 'route']
+)
+DB_CHECKOUT = Histogram(
+    'finflow_db_checkout_seconds', 'Time to get a pooled connection, including connecting',
+    ['service'], buckets=LATENCY_BUCKETS
+)
+DB_CHECKOUT_ERRORS = Counter(
+    'finflow_db_checkout_errors', 'Failed connection checkouts', ['service']
+)
+DB_QUERY = Histogram(
+    'finflow_db_query_seconds', 'Statement execution time',
+    ['service', 'query'], buckets=LATENCY_BUCKETS
+)
+DB_QUERY_ERRORS = Counter(
+    'finflow_db_query_errors', 'Statements that raised', ['service', 'query']
+)
+UPSTREAM_LATENCY = Histogram(
+    'finflow_upstream_request_duration_seconds', 'Gateway calls to a service, until response headers',
+    ['upstream', 'method', 'status'], buckets=LATENCY_BUCKETS
+)
+UPSTREAM_ERRORS = Counter(
+    'finflow_upstream_errors', 'Gateway calls that failed without a response',
+    ['upstream', 'error']
+)
+GATEWAY_READS = Counter(
+    'finflow_gateway_reads', 'Coalescible gateway GETs by how they were answered',
+    ['route', 'result']
+)
+TOKEN_VERIFY = Histogram(
+    'finflow_token_verify_seconds', 'Bearer token verification, including cache lookups',
+    ['service'], buckets=(.00001, .000025, .00005, .0001, .00025, .0005, .001, .0025, .01)
+)
+GATEWAY_SHED = Counter(
+    'finflow_gateway_shed', 'Gateway requests refused by a rate limit (429) or upstream queue (503)',
+    ['reason', 'target']
+)
+UPSTREAM_QUEUE_WAIT = Histogram(
+    'finflow_upstream_queue_wait_seconds', 'Time a gateway call waited for an upstream slot',
+    ['upstream'], buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+)
+COMPRESSION_RESPONSES = Counter(
+    'finflow_compression_responses', 'Gateway responses compressed, or served from the compressed cache',
+    ['encoding', 'result']
+)
+COMPRESSION_SAVED = Counter(
+    'finflow_compression_saved_bytes', 'Response bytes not sent thanks to compression', ['encoding']
+)
+COMPRESSION_CPU = Counter(
+    'finflow_compression_cpu_seconds', 'CPU time spent compressing responses', ['encoding']
+)
+GROUP_COMMIT_ROWS = Histogram(
+    'finflow_group_commit_rows', 'Rows written per group commit batch',
+    ['service'], buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+GROUP_COMMIT_WAIT = Histogram(
+    'finflow_group_commit_wait_seconds', 'Time a row waited in the queue before its batch was written',
+    ['service'], buckets=(.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1)
+)
+GROUP_COMMIT_WRITE = Histogram(
+    'finflow_group_commit_write_seconds', 'Time to write and commit one batch',
+    ['service'], buckets=LATENCY_BUCKETS
+)
+
+_service = 'unknown'
+
+
+def init_app(app, service):
+    global _service
+    _service = service
+
+    @app.before_request
+    def start_request_metrics():
+        incoming = request.headers.get(REQUEST_ID_HEADER, '')
+        g.request_id = incoming if _REQUEST_ID_RE.match(incoming) else uuid.uuid4().hex
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+
+        if request.endpoint == 'metrics':
+            return response
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_LATENCY.labels(service, request.method, route).observe(time.perf_counter() - started)
+        HTTP_REQUESTS.labels(service, request.method, route, str(response.status_code)).inc()
+        if response.status_code >= 500:
+            HTTP_ERRORS.labels(service, request.method, route).inc()
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def request_id():
+    """ID of the request being handled, or None outside a request"""
+    if has_request_context():
+        return g.get('request_id')
+    return None
+
+
+def observe_checkout(seconds, failed=False):
+    DB_CHECKOUT.labels(_service).observe(seconds)
+    if failed:
+        DB_CHECKOUT_ERRORS.labels(_service).inc()
+
+
+def observe_upstream(upstream, method, status, seconds):
+    UPSTREAM_LATENCY.labels(upstream, method, str(status)).observe(seconds)
+
+
+def observe_upstream_error(upstream, error):
+    UPSTREAM_ERRORS.labels(upstream, type(error).__name__).inc()
+
+
+def observe_gateway_read(route, result):
+    GATEWAY_READS.labels(route, result).inc()
+
+
+def observe_gateway_shed(reason, target):
+    GATEWAY_SHED.labels(reason, target).inc()
+
+
+def observe_upstream_queue_wait(upstream, seconds):
+    UPSTREAM_QUEUE_WAIT.labels(upstream).observe(seconds)
+
+
+def observe_compression(encoding, result, saved_bytes, cpu_seconds=0.0):
+    COMPRESSION_RESPONSES.labels(encoding, result).inc()
+    COMPRESSION_SAVED.labels(encoding).inc(max(saved_bytes, 0))
+    if cpu_seconds:
+        COMPRESSION_CPU.labels(encoding).inc(cpu_seconds)
+
+
+def observe_token_verify(seconds):
+    TOKEN_VERIFY.labels(_service).observe(seconds)
+
+
+def observe_group_commit(rows, waits, seconds):
+    GROUP_COMMIT_ROWS.labels(_service).observe(rows)
+    for wait in waits:
+        GROUP_COMMIT_WAIT.labels(_service).observe(wait)
+    GROUP_COMMIT_WRITE.labels(_service).observe(seconds)
+
+
+_VERB_RE = re.compile(r'^\s*(\w+)')
+_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+
+
+def query_label(sql):
+    """Low-cardinality label for a statement: ``insert expenses``, ``select budgets``"""
+    if isinstance(sql, bytes):
+        sql = sql[:512].decode('utf-8', 'replace')
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    verb = _VERB_RE.match(sql)
+    table = _TABLE_RE.search(sql)
+    label = verb.group(1).lower() if verb else 'unknown'
+    if label == 'with':
+        # Name a CTE statement after its final verb
+        tail = re.findall(r'\b(SELECT|INSERT|UPDATE|DELETE)\b', sql, re.IGNORECASE)
+        label = tail[-1].lower() if tail else label
+    return f'{label} {table.group(1).lower()}' if table else label
+
+
+_timed_cursor_classes = {}
+
+
+def _timed_cursor_class(base):
+    cls = _timed_cursor_classes.get(base)
+    if cls is None:
+        class TimedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                except Exception:
+                    DB_QUERY_ERRORS.labels(_service, query_label(query)).inc()
+                    raise
+                finally:
+                    DB_QUERY.labels(_service, query_label(query)).observe(time.perf_counter() - started)
+
+        TimedCursor.__name__ = f'Timed{base.__name__}'
+        cls = _timed_cursor_classes[base] = TimedCursor
+    return cls
+
+
+if extensions is not None:
+    class TimedConnection(extensions.connection):
+        """psycopg2 connection whose cursors record ``finflow_db_query_seconds``"""
+
+        def cursor(self, *args, **kwargs):
+            base = kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor
+            kwargs['cursor_factory'] = _timed_cursor_class(base)
+            return super().cursor(*args, **kwargs)
@@ -0,0 +1,317 @@
+"""On-demand sampling profiler for live requests, with collapsed-stack output.
+
+Off unless ``PROFILING_TOKEN`` is set. Without it, ``init_app`` adds
+nothing to the app. With it, a request is profiled when either:
+
+  - it carries ``X-Profile: <token>`` (the gateway forwards the header, so one
+    request can be profiled in every service it reaches), or
+  - a session started with ``POST /debug/profile?rate=0.05&seconds=300`` picks
+    it, at that sample rate, until the session expires or
+    ``DELETE /debug/profile`` stops it
+
+The admin endpoints need ``X-Profile-Token: <token>``.
+
+While requests are being profiled, a sampler thread in the worker wakes
+every ``PROFILING_INTERVAL_MS``. It records the stack of each profiled
+request thread, from the WSGI server down through ``require_auth``,
+``get_db_connection``, cursor execution and ``jsonify``, under a root frame
+naming the route. Each sample counts the time since the previous one as
+wall time. CPU time is that share of the thread's CPU clock over the same
+stretch. Samples stop when the handler returns, so a streamed body is not
+included.
+
+While it is sampling, the sampler shortens the interpreter's GIL switch
+interval so that it can interrupt a busy request thread on time. It still
+can't interrupt C code that holds the GIL, so a sample can land just after
+such code, at the next Python line or blocking call.
+
+``GET /debug/profile?kind=wall`` (or ``kind=cpu``) downloads the stacks
+aggregated since the session started. The output is collapsed-stack text,
+one ``frame;frame;... microseconds`` line per stack, ready for
+``flamegraph.pl`` or speedscope.
+
+The session's rate and expiry live in shared memory, so a session started
+through one gunicorn worker applies to all workers forked from the
+preloaded app. Each worker writes its stacks to ``PROFILING_DIR``, and the
+download merges them.
+"""
+
+import hmac
+import mmap
+import os
+import random
+import struct
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, g, jsonify, request
+
+TOKEN = os.getenv('PROFILING_TOKEN', '')
+INTERVAL = float(os.getenv('PROFILING_INTERVAL_MS', '5')) / 1000
+MAX_SECONDS = float(os.getenv('PROFILING_MAX_SECONDS', '3600'))
+MAX_DEPTH = 128
+MAX_STACKS = 20000
+
+PROFILE_HEADER = 'X-Profile'
+TOKEN_HEADER = 'X-Profile-Token'
+KINDS = ('wall', 'cpu')
+
+# rate, expires at (epoch seconds), session number
+_STATE = struct.Struct('ddQ')
+
+
+class _Target:
+    """A request thread being sampled"""
+
+    def __init__(self, label):
+        self.label = label
+        self.clock = time.pthread_getcpuclockid(threading.get_ident())
+        self.wall = time.perf_counter()
+        self.cpu = time.clock_gettime(self.clock)
+
+
+class Profiler:
+    def __init__(self, service, directory=None, interval=INTERVAL):
+        self.service = service
+        self.directory = directory
+        self.interval = interval
+
+        self._state = mmap.mmap(-1, _STATE.size)
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._targets = {}
+        self._labels = {}
+        # stack -> [wall us, cpu us]
+        self._stacks = defaultdict(lambda: [0, 0])
+        self._session = 0
+        self._dirty = False
+        self._flushed_at = 0.0
+        self._thread = None
+        self._pid = None
+
+    def state(self):
+        rate, until, session = _STATE.unpack_from(self._state)
+        return rate if time.time() < until else 0.0, until, session
+
+    def start(self, rate, seconds):
+        """Begin a new session; previous samples are discarded"""
+        _, _, session = self.state()
+        _STATE.pack_into(self._state, 0, rate, time.time() + seconds, session + 1)
+        self._remove_files(keep=session + 1)
+        return self.status()
+
+    def stop(self):
+        _, _, session = self.state()
+        _STATE.pack_into(self._state, 0, 0.0, 0.0, session)
+        return self.status()
+
+    def status(self):
+        rate, until, session = self.state()
+        with self._lock:
+            return {
+                'service': self.service,
+                'rate': rate,
+                'expires_in': round(max(until - time.time(), 0), 1) if rate else 0,
+                'session': session,
+                'profiling_now': len(self._targets),
+                'stacks': len(self._stacks) if self._session == session else 0,
+            }
+
+    def begin(self, forced=False):
+        """Sample the current request when forced or picked by the session's rate"""
+        rate, _, session = self.state()
+        if not forced and not (rate and random.random() < rate):
+            return
+        rule = request.url_rule.rule if request.url_rule else 'unmatched'
+        target = _Target(f'{self.service} {request.method} {rule}')
+        self._ensure_thread()
+        with self._lock:
+            if self._session != session:
+                self._stacks.clear()
+                self._session = session
+            self._targets[threading.get_ident()] = target
+            self._wake.notify()
+        g.profiling = True
+
+    def end(self):
+        if g.pop('profiling', False):
+            with self._lock:
+                self._targets.pop(threading.get_ident(), None)
+
+    def _ensure_thread(self):
+        # One sampler per worker, started on first use after the fork
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._targets.clear()
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        switch_interval = sys.getswitchinterval()
+        last_tick = None
+        while True:
+            with self._lock:
+                while not self._targets:
+                    if self._dirty:
+                        break
+                    last_tick = None
+                    sys.setswitchinterval(switch_interval)
+                    self._wake.wait()
+            if last_tick is None:
+                # The sampler waits for the GIL at every tick; a short switch
+                # interval stops a busy request thread from delaying it
+                sys.setswitchinterval(min(switch_interval, self.interval / 20))
+                # A random phase after idling, so requests shorter than the
+                # interval are still sampled in proportion to their length
+                time.sleep(random.uniform(0, self.interval))
+                tick = self.interval
+            else:
+                time.sleep(self.interval)
+                tick = time.perf_counter() - last_tick
+            last_tick = time.perf_counter()
+            self._sample(tick)
+            if self._dirty and time.monotonic() - self._flushed_at >= 1:
+                self.flush()
+
+    def _sample(self, tick):
+        """Credit each profiled thread's current stack with ``tick`` seconds of wall time"""
+        frames = sys._current_frames()
+        now = time.perf_counter()
+        with self._lock:
+            for ident, target in list(self._targets.items()):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                try:
+                    cpu = time.clock_gettime(target.clock)
+                except OSError:
+                    continue
+                stack = self._stack(target.label, frame)
+                if stack not in self._stacks and len(self._stacks) >= MAX_STACKS:
+                    stack = f'{target.label};[other stacks]'
+                # CPU is the thread's usage since it was last seen, scaled to the tick
+                elapsed = now - target.wall
+                busy = min((cpu - target.cpu) / elapsed, 1.0) if elapsed > 0 else 0.0
+                totals = self._stacks[stack]
+                totals[0] += int(tick * 1e6)
+                totals[1] += int(busy * tick * 1e6)
+                target.wall, target.cpu = now, cpu
+                self._dirty = True
+
+    def _stack(self, label, frame):
+        names = []
+        while frame is not None and len(names) < MAX_DEPTH:
+            code = frame.f_code
+            name = self._labels.get(code)
+            if name is None:
+                name = f'{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+                name = self._labels[code] = name.replace(';', ':')
+            names.append(name)
+            frame = frame.f_back
+        names.append(label)
+        return ';'.join(reversed(names))
+
+    def _path(self, session, pid):
+        return os.path.join(self.directory, f'{session}-{pid}.collapsed')
+
+    def flush(self):
+        """Write this worker's stacks for the other workers' downloads"""
+        with self._lock:
+            self._dirty = False
+            self._flushed_at = time.monotonic()
+            if not self.directory or not self._stacks:
+                return
+            lines = [f'{stack}\t{wall}\t{cpu}\n' for stack, (wall, cpu) in self._stacks.items()]
+            path = self._path(self._session, os.getpid())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(f'{path}.tmp', 'w') as f:
+                f.writelines(lines)
+            os.replace(f'{path}.tmp', path)
+        except OSError as e:
+            print(f"Could not write profile samples: {e}")
+
+    def _remove_files(self, keep):
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if not name.startswith(f'{keep}-'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def collapsed(self, kind):
+        """Collapsed-stack text for the current session, summed over workers"""
+        column = KINDS.index(kind)
+        _, _, session = self.state()
+        totals = defaultdict(int)
+        if self.directory:
+            self.flush()
+            prefix = f'{session}-'
+            names = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+            for name in names:
+                if not name.startswith(prefix) or not name.endswith('.collapsed'):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        for line in f:
+                            stack, *values = line.rstrip('\n').split('\t')
+                            totals[stack] += int(values[column])
+                except (OSError, ValueError, IndexError):
+                    continue
+        else:
+            with self._lock:
+                if self._session == session:
+                    for stack, values in self._stacks.items():
+                        totals[stack] += values[column]
+        return ''.join(f'{stack} {value}\n' for stack, value in sorted(totals.items()) if value > 0)
+
+
+def _authorized(header):
+    return hmac.compare_digest(request.headers.get(header, ''), TOKEN)
+
+
+def init_app(app, service):
+    """Register the profiling hooks and /debug/profile when PROFILING_TOKEN is set"""
+    if not TOKEN:
+        return None
+    profiler = Profiler(service, os.getenv('PROFILING_DIR') or None)
+
+    @app.before_request
+    def start_profiling():
+        profiler.begin(forced=PROFILE_HEADER in request.headers and _authorized(PROFILE_HEADER))
+
+    @app.teardown_request
+    def stop_profiling(exc):
+        profiler.end()
+
+    @app.route('/debug/profile', methods=['GET', 'POST', 'DELETE'])
+    def profile():
+        if not _authorized(TOKEN_HEADER):
+            return jsonify({'error': 'Profiling token required'}), 403
+        if request.method == 'DELETE':
+            return jsonify(profiler.stop())
+        if request.method == 'POST':
+            try:
+                rate = float(request.args.get('rate', '0.01'))
+                seconds = float(request.args.get('seconds', '300'))
+            except ValueError:
+                return jsonify({'error': 'rate and seconds must be numbers'}), 400
+            if not 0 < rate <= 1 or not 0 < seconds <= MAX_SECONDS:
+                return jsonify({'error': f'rate must be in (0, 1] and seconds in (0, {MAX_SECONDS:g}]'}), 400
+            return jsonify(profiler.start(rate, seconds))
+
+        kind = request.args.get('kind', 'wall')
+        if kind not in KINDS:
+            return jsonify({'error': 'kind must be wall or cpu'}), 400
+        return Response(profiler.collapsed(kind), mimetype='text/plain', headers={
+            'Content-Disposition': f'attachment; filename="{service}-{kind}.collapsed"'
+        })
+
+    return profiler
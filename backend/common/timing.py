@@ -0,0 +1,76 @@
+"""Server-Timing headers for per-hop latency.
+
+With ``SERVER_TIMING=1`` a service reports how long it spent on each request,
+and on named parts of it, in a ``Server-Timing`` response header:
+
+    Server-Timing: finance;dur=4.12, finance-db;dur=2.70
+
+The gateway relays upstream headers untouched and adds its own entry, so the
+client sees every hop. Durations are in milliseconds and end when the
+response headers are produced; time spent streaming a body is not included.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+ENABLED = os.getenv('SERVER_TIMING', '0') == '1'
+
+
+def init_app(app, name):
+    """Time every request to ``app`` and report it as ``name``"""
+    if not ENABLED:
+        return
+
+    @app.before_request
+    def start_server_timing():
+        g.server_timing = {}
+        g.server_timing_open = {}
+        g.server_timing_started = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        started = g.get('server_timing_started')
+        if started is None:
+            return response
+        entries = [(name, time.perf_counter() - started)]
+        entries.extend((f'{name}-{metric}', seconds) for metric, seconds in g.server_timing.items())
+        response.headers.add(
+            'Server-Timing',
+            ', '.join(f'{metric};dur={seconds * 1000:.2f}' for metric, seconds in entries)
+        )
+        return response
+
+
+def _active():
+    return ENABLED and has_request_context() and 'server_timing' in g
+
+
+def record(metric, seconds):
+    """Add ``seconds`` to ``metric`` for the current request"""
+    if _active():
+        g.server_timing[metric] = g.server_timing.get(metric, 0.0) + seconds
+
+
+def begin(metric):
+    """Start timing ``metric``; for spans that don't fit a ``with`` block"""
+    if _active():
+        g.server_timing_open[metric] = time.perf_counter()
+
+
+def end(metric):
+    if _active():
+        started = g.server_timing_open.pop(metric, None)
+        if started is not None:
+            record(metric, time.perf_counter() - started)
+
+
+@contextmanager
+def timed(metric):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(metric, time.perf_counter() - started)
@@ -0,0 +1,117 @@
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+
+class TokenVerifier:
+    """Verify HS256 JWTs, caching decoded payloads by token digest.
+
+    A cached payload is kept for at most ``ttl`` seconds and never past the
+    token's own ``exp`` claim, so caching cannot extend a token's lifetime.
+    Only successfully verified tokens are cached.
+    """
+
+    def __init__(self, secret_key, algorithms=('HS256',), max_entries=10000, ttl=300.0):
+        self.secret_key = secret_key
+        self.algorithms = list(algorithms)
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'invalid': 0,
+            'evictions': 0,
+        }
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def decode(self, token):
+        """Return the token payload or raise a ``jwt.InvalidTokenError``"""
+        key = self._key(token)
+        now = time.time()
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                payload, expires_at, exp = entry
+                if exp is not None and now >= exp:
+                    del self._cache[key]
+                    self._stats['expired'] += 1
+                    raise jwt.ExpiredSignatureError('Signature has expired')
+                if now < expires_at:
+                    self._cache.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return payload
+                del self._cache[key]
+            self._stats['misses'] += 1
+
+        try:
+            payload = jwt.decode(token, self.secret_key, algorithms=self.algorithms)
+        except jwt.ExpiredSignatureError:
+            with self._lock:
+                self._stats['expired'] += 1
+            raise
+        except jwt.InvalidTokenError:
+            with self._lock:
+                self._stats['invalid'] += 1
+            raise
+
+        exp = payload.get('exp')
+        expires_at = now + self.ttl
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        else:
+            exp = None
+
+        with self._lock:
+            self._cache[key] = (payload, expires_at, exp)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+                self._stats['evictions'] += 1
+        return payload
+
+    def verify(self, token):
+        """Return the token payload, or None if it is missing, invalid or expired"""
+        if not token:
+            return None
+        try:
+            return self.decode(token)
+        except jwt.InvalidTokenError:
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._cache)
+            stats['max_entries'] = self.max_entries
+            return stats
+
+
+def bearer_token(authorization):
+    """Extract the token from an ``Authorization: Bearer ...`` header value"""
+    return (authorization or '').replace('Bearer ', '')
+
+
+def verifier_from_env(secret_key):
+    """Build a verifier configured from the TOKEN_CACHE_* environment variables"""
+    return TokenVerifier(
+        secret_key,
+        max_entries=int(os.getenv('TOKEN_CACHE_MAX_ENTRIES', '10000')),
+        ttl=float(os.getenv('TOKEN_CACHE_TTL', '300')),
+    )
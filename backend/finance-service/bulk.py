@@ -0,0 +1,164 @@
+"""Streaming CSV/NDJSON import for expenses and income.
+
+Rows are parsed and validated as the request body arrives and written in
+batches with ``execute_values`` inside a single transaction. Invalid rows
+are skipped and reported; they never abort the rest of the import.
+"""
+
+import codecs
+import csv
+import json
+import os
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from psycopg2.extras import execute_values
+
+import budgets
+import rollups
+
+BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', '1000'))
+MAX_REPORTED_ERRORS = int(os.getenv('BULK_MAX_REPORTED_ERRORS', '100'))
+
+CSV_MIMETYPES = ('text/csv', 'application/csv')
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+MAX_AMOUNT = Decimal('99999999.99')  # DECIMAL(10,2)
+
+# table -> (rollup kind, [(column, max length or None)])
+TABLES = {
+    'expenses': ('expense', [('amount', None), ('description', None), ('category', 50), ('date', None)]),
+    'income': ('income', [('amount', None), ('source', 100), ('date', None)]),
+}
+
+
+class UnsupportedFormat(ValueError):
+    """Raised when the request body is neither CSV nor NDJSON"""
+
+
+def iter_records(stream, mimetype):
+    """Yield ``(line_number, record)`` pairs from a CSV or NDJSON byte stream.
+
+    Lines that cannot be parsed are yielded as a ``ValueError`` so they can
+    be reported alongside validation errors.
+    """
+    if mimetype in CSV_MIMETYPES:
+        reader = csv.DictReader(codecs.iterdecode(stream, 'utf-8-sig'))
+        for record in reader:
+            yield reader.line_num, record
+    elif mimetype in NDJSON_MIMETYPES:
+        for line_number, line in enumerate(stream, start=1):
+            try:
+                line = line.decode('utf-8').strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+            except ValueError as e:
+                record = ValueError(f'invalid JSON: {e}')
+            yield line_number, record
+    else:
+        raise UnsupportedFormat('Content-Type must be text/csv or application/x-ndjson')
+
+
+def validate(table, record):
+    """Return the row's column values in insert order, or raise ValueError"""
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError('row must be an object')
+
+    values = []
+    for column, max_length in TABLES[table][1]:
+        value = record.get(column)
+        if column == 'amount':
+            try:
+                value = Decimal(str(value).strip()).quantize(Decimal('0.01'))
+            except (InvalidOperation, ValueError):
+                raise ValueError(f'invalid amount: {value!r}')
+            if not value.is_finite() or abs(value) > MAX_AMOUNT:
+                raise ValueError(f'amount out of range: {value}')
+        elif column == 'date':
+            try:
+                value = date.fromisoformat(str(value).strip())
+            except ValueError:
+                raise ValueError(f'invalid date: {value!r}')
+        else:
+            value = None if value is None else str(value)
+            if max_length and value and len(value) > max_length:
+                raise ValueError(f'{column} longer than {max_length} characters')
+        values.append(value)
+    return values
+
+
+def _insert_sql(table):
+    columns = ', '.join(['user_id'] + [column for column, _ in TABLES[table][1]])
+    return f"INSERT INTO {table} ({columns}) VALUES %s"
+
+
+def import_records(conn, table, user_id, records, dry_run=False):
+    """Validate and load ``records``, returning ``(summary, accepted)``.
+
+    Nothing is written in a dry run. Without a connection (test users) the
+    validated rows are returned in ``accepted`` for the caller to store.
+    """
+    kind, columns = TABLES[table]
+    category_column = rollups.KINDS[kind][1]
+    category_index = [column for column, _ in columns].index(category_column)
+
+    summary = {'received': 0, 'inserted': 0, 'rejected': 0, 'errors': [], 'dry_run': dry_run}
+    deltas = defaultdict(lambda: [Decimal('0'), 0])
+    spend = budgets.SpendAccumulator()
+    batch = []
+    accepted = []
+
+    cur = conn.cursor() if conn is not None and not dry_run else None
+
+    def flush():
+        if cur is not None and batch:
+            execute_values(cur, _insert_sql(table), batch, page_size=len(batch))
+        batch.clear()
+
+    try:
+        for line_number, record in records:
+            summary['received'] += 1
+            try:
+                values = validate(table, record)
+            except ValueError as e:
+                summary['rejected'] += 1
+                if len(summary['errors']) < MAX_REPORTED_ERRORS:
+                    summary['errors'].append({'line': line_number, 'error': str(e)})
+                continue
+
+            amount, entry_date = values[0], values[-1]
+            bucket = deltas[(rollups.month_start(entry_date), values[category_index] or '')]
+            bucket[0] += amount
+            bucket[1] += 1
+            if table == 'expenses':
+                spend.add(values[category_index], entry_date, amount)
+
+            if conn is None:
+                accepted.append(values)
+            elif cur is not None:
+                batch.append([user_id] + values)
+                if len(batch) >= BATCH_SIZE:
+                    flush()
+
+        flush()
+        if cur is not None:
+            for (month, category), (total, count) in deltas.items():
+                rollups.apply_delta(cur, kind, user_id, month, category, total, count)
+            budgets.apply_spend(cur, user_id, spend.entries())
+            conn.commit()
+            summary['inserted'] = summary['received'] - summary['rejected']
+    except Exception:
+        if cur is not None:
+            conn.rollback()
+        raise
+    finally:
+        if cur is not None:
+            cur.close()
+
+    summary['valid'] = summary['received'] - summary['rejected']
+    summary['truncated_errors'] = summary['rejected'] > len(summary['errors'])
+    return summary, accepted
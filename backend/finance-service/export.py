@@ -0,0 +1,269 @@
+"""Streaming export of a user's ledger (expenses and income) as CSV, Parquet or NDJSON.
+
+Nothing is loaded whole. CSV comes straight from Postgres through ``COPY ...
+TO STDOUT``. Parquet and NDJSON are written from a server-side cursor in
+batches of ``EXPORT_BATCH_SIZE`` rows, and each Parquet batch becomes one row
+group. Every chunk is handed to the response as soon as it is encoded, so
+memory use doesn't depend on the size of the ledger.
+
+Parquet needs ``pyarrow``; without it that format answers 501.
+"""
+
+import csv
+import io
+import json
+import os
+import queue
+import threading
+from datetime import date
+from decimal import Decimal
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '10000'))
+CHUNK_SIZE = 64 * 1024
+# Chunks COPY may run ahead of a slow client before it waits
+QUEUE_CHUNKS = 16
+
+COLUMNS = ('type', 'id', 'date', 'amount', 'category', 'source', 'description')
+
+# format -> (mimetype, file extension)
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+if pa is not None:
+    PARQUET_SCHEMA = pa.schema([
+        ('type', pa.string()),
+        ('id', pa.int64()),
+        ('date', pa.date32()),
+        ('amount', pa.decimal128(10, 2)),
+        ('category', pa.string()),
+        ('source', pa.string()),
+        ('description', pa.string()),
+    ])
+
+
+def parquet_available():
+    return pa is not None
+
+
+def ledger_query(user_id, start=None, end=None):
+    """Both tables as one ``COLUMNS`` result in date order, ``start`` <= date <= ``end``"""
+    date_filter = ''
+    params = {'user_id': user_id}
+    if start:
+        date_filter += ' AND date >= %(start)s'
+        params['start'] = start
+    if end:
+        date_filter += ' AND date <= %(end)s'
+        params['end'] = end
+    sql = f"""
+        SELECT 'expense' AS type, id, date, amount, category, NULL AS source, description
+        FROM expenses WHERE user_id = %(user_id)s{date_filter}
+        UNION ALL
+        SELECT 'income', id, date, amount, NULL, source, NULL
+        FROM income WHERE user_id = %(user_id)s{date_filter}
+        ORDER BY date, type, id
+    """
+    return sql, params
+
+
+def memory_ledger(expenses, income):
+    """``COLUMNS`` tuples for memory store records, in the same order as ``ledger_query``"""
+    rows = [
+        ('expense', r['id'], _as_date(r['date']), _amount(r['amount']),
+         r.get('category'), None, r.get('description'))
+        for r in expenses
+    ]
+    rows.extend(
+        ('income', r['id'], _as_date(r['date']), _amount(r['amount']),
+         None, r.get('source'), None)
+        for r in income
+    )
+    rows.sort(key=lambda row: (row[2], row[0], row[1]))
+    return rows
+
+
+def _amount(value):
+    return Decimal(str(value)).quantize(Decimal('0.01'))
+
+
+def _as_date(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def batched(rows, size=BATCH_SIZE):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def cursor_batches(conn, sql, params, size=BATCH_SIZE):
+    """Lists of up to ``size`` row tuples from a server-side cursor"""
+    cur = conn.cursor(name='export')
+    cur.itersize = size
+    try:
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cur.close()
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _CopySink:
+    """File object for ``copy_expert`` that passes chunks to the response through a bounded queue"""
+
+    def __init__(self):
+        self.queue = queue.Queue(QUEUE_CHUNKS)
+        self.cancelled = threading.Event()
+        self.error = None
+        self._buffer = []
+        self._size = 0
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.put(b''.join(self._buffer))
+            self._buffer = []
+            self._size = 0
+
+    def put(self, item):
+        # Wait for the client, but give up as soon as the response is abandoned
+        while True:
+            if self.cancelled.is_set():
+                raise _Cancelled()
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+
+def copy_csv(conn, sql, params):
+    """CSV bytes (with a header row) from ``COPY (sql) TO STDOUT`` as Postgres produces them"""
+    sink = _CopySink()
+
+    def run():
+        try:
+            with conn.cursor() as cur:
+                query = cur.mogrify(sql, params).decode()
+                cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", sink)
+            sink.flush()
+        except _Cancelled:
+            pass
+        except Exception as e:
+            sink.error = e
+        finally:
+            try:
+                sink.put(None)
+            except _Cancelled:
+                pass
+
+    # COPY writes through a callback, so it runs in a thread and the response
+    # generator reads from the queue
+    thread = threading.Thread(target=run, name='export-copy', daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = sink.queue.get()
+            if chunk is None:
+                break
+            yield chunk
+        if sink.error is not None:
+            raise sink.error
+    finally:
+        if thread.is_alive():
+            sink.cancelled.set()
+            conn.cancel()
+        thread.join()
+
+
+def csv_chunks(batches):
+    yield _csv_encode([COLUMNS])
+    for rows in batches:
+        yield _csv_encode(rows)
+
+
+def _csv_encode(rows):
+    out = io.StringIO()
+    csv.writer(out, lineterminator='\n').writerows(rows)
+    return out.getvalue().encode()
+
+
+def ndjson_chunks(batches):
+    for rows in batches:
+        yield ''.join(
+            json.dumps(dict(zip(COLUMNS, row)), default=str) + '\n' for row in rows
+        ).encode()
+
+
+class _ParquetSink:
+    """Write-only file that lets the encoded bytes be taken after each row group"""
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def parquet_chunks(batches):
+    sink = _ParquetSink()
+    file = pa.PythonFile(sink, mode='w')
+    writer = pq.ParquetWriter(file, PARQUET_SCHEMA)
+    try:
+        for rows in batches:
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, PARQUET_SCHEMA)],
+                schema=PARQUET_SCHEMA,
+            ))
+            yield sink.take()
+    finally:
+        writer.close()
+        file.close()
+    # The footer, written on close
+    yield sink.take()
+
+
+ENCODERS = {
+    'csv': csv_chunks,
+    'parquet': parquet_chunks,
+    'ndjson': ndjson_chunks,
+}
@@ -0,0 +1,231 @@
+"""Group commit for single-row POST /expenses and POST /income.
+
+With ``GROUP_COMMIT=1`` a create request doesn't write its own row. It
+queues the row and waits. A flusher thread collects rows for up to
+``GROUP_COMMIT_WINDOW_MS`` after the first one arrives, or until
+``GROUP_COMMIT_MAX_ROWS`` are waiting. It then writes them all in one
+transaction on one connection: one multi-row INSERT per table, the rollup
+and budget spend deltas summed over the batch, and a single commit. Each
+caller gets back its own inserted row.
+
+If the batch INSERT fails, the transaction is rolled back and the rows are
+inserted one by one, each under a savepoint, so that only the bad rows fail
+and each caller sees its own error. The other rows still commit together.
+
+Like the read coalescer in the gateway this works per worker process, and
+only when a worker handles requests concurrently (GUNICORN_THREADS > 1).
+Each write still waits for its commit, so a 201 always means the row is
+durable.
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+
+import budgets
+import rollups
+from bulk import TABLES
+from common import metrics
+from pagination import RECORD_COLUMNS
+
+CASTS = {'amount': 'numeric', 'date': 'date'}
+
+
+class Unavailable(Exception):
+    """Raised when the batch could not get a database connection"""
+
+
+class _Entry:
+    def __init__(self, table, user_id, values):
+        self.table = table
+        self.user_id = user_id
+        self.values = values
+        self.queued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.row = None
+        self.error = None
+
+
+def _columns(table):
+    return [column for column, _ in TABLES[table][1]]
+
+
+def _batch_sql(table):
+    columns = ', '.join(_columns(table))
+    # Rows go in ordered by n, so their serial ids come out in the same order
+    return f"""
+        INSERT INTO {table} (user_id, {columns})
+        SELECT user_id, {columns} FROM (VALUES %s) AS v (n, user_id, {columns})
+        ORDER BY n
+        RETURNING {RECORD_COLUMNS[table]}
+    """
+
+
+def _batch_template(table):
+    casts = [f"%s::{CASTS.get(column, 'text')}" for column in _columns(table)]
+    return f"(%s::integer, %s::integer, {', '.join(casts)})"
+
+
+def _row_sql(table):
+    columns = _columns(table)
+    return (f"INSERT INTO {table} (user_id, {', '.join(columns)}) "
+            f"VALUES ({', '.join(['%s'] * (len(columns) + 1))}) RETURNING {RECORD_COLUMNS[table]}")
+
+
+class GroupCommitter:
+    """Queues single-row inserts and commits them in batches from one thread"""
+
+    def __init__(self, pool, window=0.002, max_rows=100):
+        self.pool = pool
+        self.window = window
+        self.max_rows = max_rows
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stats = {'batches': 0, 'rows': 0, 'failed_rows': 0, 'fallbacks': 0, 'max_batch': 0}
+
+    def insert(self, table, user_id, values):
+        """Insert one row of ``TABLES[table]`` values; returns the row or raises its error"""
+        self._start()
+        entry = _Entry(table, user_id, values)
+        self._queue.put(entry)
+        entry.done.wait()
+        if entry.error is not None:
+            raise entry.error
+        return entry.row
+
+    def _start(self):
+        # The thread is started on first use, so each gunicorn worker gets its own
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_rows:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            started = time.perf_counter()
+            try:
+                self._flush(batch)
+            except Exception as e:
+                for entry in batch:
+                    if entry.row is None and entry.error is None:
+                        entry.error = e
+            finally:
+                metrics.observe_group_commit(
+                    len(batch), [started - entry.queued_at for entry in batch], time.perf_counter() - started
+                )
+                with self._lock:
+                    self._stats['batches'] += 1
+                    self._stats['rows'] += len(batch)
+                    self._stats['failed_rows'] += sum(entry.error is not None for entry in batch)
+                    self._stats['max_batch'] = max(self._stats['max_batch'], len(batch))
+                for entry in batch:
+                    entry.done.set()
+
+    def _flush(self, batch):
+        try:
+            conn = self.pool.getconn()
+        except Exception as e:
+            print(f"Group commit could not get a database connection: {e}")
+            raise Unavailable('Database not available')
+
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                try:
+                    self._insert_batch(cur, batch)
+                except psycopg2.DatabaseError:
+                    conn.rollback()
+                    with self._lock:
+                        self._stats['fallbacks'] += 1
+                    self._insert_rows(cur, batch)
+                self._apply_deltas(cur, [entry for entry in batch if entry.error is None])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                for entry in batch:
+                    entry.row = None
+                raise
+            finally:
+                cur.close()
+        finally:
+            self.pool.putconn(conn)
+
+    def _insert_batch(self, cur, batch):
+        by_table = defaultdict(list)
+        for entry in batch:
+            by_table[entry.table].append(entry)
+        for table, entries in by_table.items():
+            rows = execute_values(
+                cur, _batch_sql(table),
+                [[n, entry.user_id] + entry.values for n, entry in enumerate(entries)],
+                template=_batch_template(table), page_size=len(entries), fetch=True,
+            )
+            for entry, row in zip(entries, sorted(rows, key=lambda row: row['id'])):
+                entry.row = row
+
+    def _insert_rows(self, cur, batch):
+        for entry in batch:
+            entry.row = None
+            cur.execute("SAVEPOINT group_commit_row")
+            try:
+                cur.execute(_row_sql(entry.table), [entry.user_id] + entry.values)
+                entry.row = cur.fetchone()
+                cur.execute("RELEASE SAVEPOINT group_commit_row")
+            except psycopg2.DatabaseError as e:
+                cur.execute("ROLLBACK TO SAVEPOINT group_commit_row")
+                entry.error = e
+
+    def _apply_deltas(self, cur, entries):
+        """Rollup and budget spend changes for the inserted rows, summed per bucket"""
+        deltas = defaultdict(lambda: [Decimal('0'), 0])
+        spend = defaultdict(Decimal)
+        for entry in entries:
+            kind = TABLES[entry.table][0]
+            row = entry.row
+            params = rollups.insert_params(kind, row)
+            bucket = deltas[params[:4]]
+            bucket[0] += row['amount']
+            bucket[1] += 1
+            if entry.table == 'expenses' and row['category']:
+                spend[(row['user_id'], row['category'], row['date'])] += row['amount']
+
+        rollups.apply_deltas(cur, [key + tuple(totals) for key, totals in deltas.items()])
+        budgets.apply_spend_rows(cur, [key + (amount,) for key, amount in spend.items()])
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(queued=self._queue.qsize(), window_ms=self.window * 1000, max_rows=self.max_rows)
+        return stats
+
+
+def committer_from_env(pool):
+    """A GroupCommitter on ``pool`` when GROUP_COMMIT=1, else None"""
+    if os.getenv('GROUP_COMMIT', '0') != '1':
+        return None
+    return GroupCommitter(
+        pool,
+        window=float(os.getenv('GROUP_COMMIT_WINDOW_MS', '2')) / 1000,
+        max_rows=int(os.getenv('GROUP_COMMIT_MAX_ROWS', '100')),
+    )
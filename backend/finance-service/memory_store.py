@@ -0,0 +1,189 @@
+"""In-memory storage for test users.
+
+Test users (the demo logins, and load tests that run without a database)
+are served from here instead of Postgres. Each user gets a private copy of
+the demo data in ``MOCK_DATA`` on first use. Records are kept sorted by
+(date, id), so latest-N, keyset-page and date-range reads are bisections
+rather than scans. Ids come from one counter per table, so concurrent
+writers never collide.
+
+Memory is bounded. At most ``MEMORY_STORE_MAX_USERS`` users are kept, and
+the least recently used user is evicted first. Each user keeps at most
+``MEMORY_STORE_MAX_RECORDS`` rows per table, and the oldest rows by date
+are dropped first.
+
+Budget spend is not stored: each read sums the user's expenses in the
+budget's category over its current period, as the database path's
+``budget_spend`` buckets do, and amounts come back as two-decimal strings
+like the database path's.
+
+The store lives in the server process. With several workers, a write is
+only visible to the worker that handled it.
+"""
+
+import copy
+import itertools
+import os
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from budgets import period_start
+from mock_data import MOCK_DATA
+from rollups import cents
+
+MAX_USERS = int(os.getenv('MEMORY_STORE_MAX_USERS', '1000'))
+MAX_RECORDS = int(os.getenv('MEMORY_STORE_MAX_RECORDS', '10000'))
+
+TABLES = ('expenses', 'income')
+
+
+def _as_date(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+class _Table:
+    """Records in ascending (date, id) order with a parallel list of sort keys"""
+
+    def __init__(self):
+        self.keys = []
+        self.records = []
+
+    def add(self, record):
+        key = (_as_date(record['date']), record['id'])
+        if not self.keys or key > self.keys[-1]:
+            # Appending new, recent entries is the common case
+            self.keys.append(key)
+            self.records.append(record)
+            return
+        index = bisect_left(self.keys, key)
+        self.keys.insert(index, key)
+        self.records.insert(index, record)
+
+    def trim(self, max_records):
+        excess = len(self.records) - max_records
+        if excess > 0:
+            del self.keys[:excess]
+            del self.records[:excess]
+        return max(excess, 0)
+
+    def newest(self, limit=None, after=None):
+        """Newest first, optionally strictly older than the ``after`` key"""
+        end = bisect_left(self.keys, after) if after else len(self.records)
+        start = 0 if limit is None else max(end - limit, 0)
+        return self.records[start:end][::-1]
+
+    def between(self, start=None, end=None):
+        """Oldest first, with ``start`` <= date <= ``end``"""
+        lo = bisect_left(self.keys, (start,)) if start else 0
+        hi = bisect_left(self.keys, (end + timedelta(days=1),)) if end else len(self.records)
+        return self.records[lo:hi]
+
+
+class _Partition:
+    def __init__(self, seed):
+        self.lock = threading.Lock()
+        self.tables = {table: _Table() for table in TABLES}
+        for table in TABLES:
+            for record in seed[table]:
+                self.tables[table].add(dict(record))
+        self.budgets = copy.deepcopy(seed['budgets'])
+
+
+class MemoryStore:
+    """Per-user expenses, income and budgets with the reads the API needs"""
+
+    def __init__(self, seed=MOCK_DATA, max_users=MAX_USERS, max_records=MAX_RECORDS):
+        self.seed = seed
+        self.max_users = max_users
+        self.max_records = max_records
+        self._lock = threading.Lock()
+        self._partitions = OrderedDict()
+        # Start above the seeded ids so new records never reuse one
+        self._ids = {
+            table: itertools.count(max((record['id'] for record in seed[table]), default=0) + 1)
+            for table in TABLES
+        }
+        self._stats = {'users_created': 0, 'users_evicted': 0, 'records_evicted': 0}
+
+    def _partition(self, user_key):
+        with self._lock:
+            partition = self._partitions.get(user_key)
+            if partition is not None:
+                self._partitions.move_to_end(user_key)
+                return partition
+
+            partition = self._partitions[user_key] = _Partition(self.seed)
+            self._stats['users_created'] += 1
+            while len(self._partitions) > self.max_users:
+                self._partitions.popitem(last=False)
+                self._stats['users_evicted'] += 1
+            return partition
+
+    def list(self, user_key, table, limit=None, after=None):
+        """Newest first, up to ``limit + 1`` rows; same contract as ``list_query``"""
+        partition = self._partition(user_key)
+        with partition.lock:
+            records = partition.tables[table].newest(None if limit is None else limit + 1, after)
+        return [dict(record) for record in records]
+
+    def between(self, user_key, table, start=None, end=None):
+        partition = self._partition(user_key)
+        with partition.lock:
+            return [dict(record) for record in partition.tables[table].between(start, end)]
+
+    def insert(self, user_key, table, values):
+        return self.insert_many(user_key, table, [values])[0]
+
+    def insert_many(self, user_key, table, rows):
+        """Store ``rows`` (dicts without ids) and return them with their new ids"""
+        partition = self._partition(user_key)
+        # next() on an itertools.count is atomic, so ids are unique across partitions
+        ids = self._ids[table]
+        inserted = []
+        with partition.lock:
+            target = partition.tables[table]
+            for values in rows:
+                record = dict(values, id=next(ids))
+                target.add(record)
+                inserted.append(dict(record))
+            evicted = target.trim(self.max_records)
+        if evicted:
+            with self._lock:
+                self._stats['records_evicted'] += evicted
+        return inserted
+
+    def budgets(self, user_key, today=None):
+        """Budgets with spent and remaining for the period containing ``today``"""
+        today = today or date.today()
+        partition = self._partition(user_key)
+        result = []
+        with partition.lock:
+            expenses = partition.tables['expenses']
+            for budget in partition.budgets:
+                period = budget.get('period', 'monthly')
+                start = period_start(period, today)
+                spent = Decimal('0')
+                for record in expenses.between(start):
+                    if record['category'] == budget['category'] and period_start(period, record['date']) == start:
+                        spent += cents(record['amount'])
+                budgeted = cents(budget['budgeted'])
+                result.append(dict(
+                    budget, budgeted=budgeted, period_start=start, spent=spent, remaining=budgeted - spent
+                ))
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+
+    def stats(self):
+        with self._lock:
+            partitions = list(self._partitions.values())
+            stats = dict(self._stats, users=len(partitions), max_users=self.max_users,
+                         max_records=self.max_records)
+        stats['records'] = sum(len(table.records) for partition in partitions
+                               for table in partition.tables.values())
+        return stats
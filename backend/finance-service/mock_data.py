@@ -0,0 +1,17 @@
+
+# Mock data for test users
+MOCK_DATA = {
+    'expenses': [
+        {'id': 1, 'amount': 50.00, 'description': 'Groceries', 'category': 'Food', 'date': '2024-01-15'},
+        {'id': 2, 'amount': 30.00, 'description': 'Gas', 'category': 'Transportation', 'date': '2024-01-14'},
+        {'id': 3, 'amount': 100.00, 'description': 'Utilities', 'category': 'Bills', 'date': '2024-01-13'}
+    ],
+    'income': [
+        {'id': 1, 'amount': 3000.00, 'source': 'Salary', 'date': '2024-01-01'},
+        {'id': 2, 'amount': 500.00, 'source': 'Freelance', 'date': '2024-01-10'}
+    ],
+    'budgets': [
+        {'id': 1, 'category': 'Food', 'budgeted': 300.00, 'spent': 150.00, 'remaining': 150.00, 'period': 'monthly'},
+        {'id': 2, 'category': 'Transportation', 'budgeted': 200.00, 'spent': 80.00, 'remaining': 120.00, 'period': 'monthly'}
+    ]
+}
@@ -0,0 +1,107 @@
+
+import base64
+import json
+import os
+from datetime import date
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+DEFAULT_PAGE_LIMIT = int(os.getenv('DEFAULT_PAGE_LIMIT', '50'))
+MAX_PAGE_LIMIT = int(os.getenv('MAX_PAGE_LIMIT', '500'))
+STREAM_ITERSIZE = int(os.getenv('STREAM_ITERSIZE', '2000'))
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Columns a record is returned with; expenses.search_vector stays internal
+RECORD_COLUMNS = {
+    'expenses': 'id, user_id, amount, description, category, date, created_at',
+    'income': 'id, user_id, amount, source, date, created_at',
+}
+
+
+class PageError(ValueError):
+    """Raised for malformed ``limit`` or ``after`` parameters"""
+
+
+def encode_cursor(record):
+    """Opaque cursor pointing just past ``record`` in (date DESC, id DESC) order"""
+    record_date = record['date']
+    if isinstance(record_date, date):
+        record_date = record_date.isoformat()
+    raw = json.dumps([record_date, record['id']], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        record_date, record_id = json.loads(raw)
+        return date.fromisoformat(record_date), int(record_id)
+    except (ValueError, TypeError):
+        raise PageError('Invalid cursor')
+
+
+def page_args(args):
+    """Parse ``limit``/``after`` query arguments.
+
+    Returns ``(limit, after)``; ``limit`` is None when the client asked for
+    neither, which keeps the original unpaginated list response.
+    """
+    after = args.get('after')
+    limit = args.get('limit')
+
+    if limit is None:
+        limit = DEFAULT_PAGE_LIMIT if after else None
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise PageError('limit must be an integer')
+        if limit < 1:
+            raise PageError('limit must be positive')
+        limit = min(limit, MAX_PAGE_LIMIT)
+
+    return limit, decode_cursor(after) if after else None
+
+
+def list_query(table, user_id, limit=None, after=None):
+    """Keyset query over ``table`` backed by the (user_id, date DESC, id DESC) index"""
+    sql = f"SELECT {RECORD_COLUMNS[table]} FROM {table} WHERE user_id = %s"
+    params = [user_id]
+    if after:
+        sql += " AND (date, id) < (%s, %s)"
+        params.extend(after)
+    sql += " ORDER BY date DESC, id DESC"
+    if limit is not None:
+        # One extra row tells us whether there is a next page
+        sql += " LIMIT %s"
+        params.append(limit + 1)
+    return sql, params
+
+
+def paginate_records(records, limit=None, after=None):
+    """Apply the same keyset ordering and cursor to an in-memory list"""
+    def key(record):
+        record_date = record['date']
+        if isinstance(record_date, str):
+            record_date = date.fromisoformat(record_date)
+        return record_date, record['id']
+
+    records = sorted(records, key=key, reverse=True)
+    if after:
+        records = [record for record in records if key(record) < after]
+    if limit is not None:
+        records = records[:limit + 1]
+    return records
+
+
+def page(records, limit):
+    """Build the paginated response body from up to ``limit + 1`` records"""
+    items = records[:limit]
+    next_cursor = encode_cursor(items[-1]) if len(records) > limit else None
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+def wants_ndjson(accept_header):
+    return parse_accept_header(accept_header, MIMEAccept).best == NDJSON_MIMETYPE
@@ -0,0 +1,284 @@
+"""Send reads to streaming replicas, writes to the primary.
+
+``DATABASE_REPLICA_URLS`` lists replica DSNs, separated by commas. Read
+handlers check out a connection through ``ReplicaRouter.getconn``, which
+picks the next eligible replica round-robin. Everything else keeps using the
+primary pool. A replica is eligible when its last probe succeeded, it is in
+recovery, and its replay lag is at most ``REPLICA_MAX_LAG`` seconds. With no
+eligible replica, or when a checkout fails, reads fall back to the primary.
+
+Read-your-writes: after a user's write commits, ``note_write`` records the
+primary's WAL position and pins the user for ``REPLICA_PIN_SECONDS``. While
+pinned, the user's reads only go to replicas that have replayed up to that
+position, which usually means the primary. Keep the pin longer than the
+maximum lag plus one probe interval.
+
+Pins live in an anonymous shared memory map, as data versions do, so a
+write handled by one worker pins the user's reads in every worker forked
+from the same preloaded app. Users are hashed into slots. A collision only
+pins another user as well. Replica health is probed by a thread in each
+worker every ``REPLICA_CHECK_INTERVAL`` seconds.
+"""
+
+import itertools
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
+import time
+import zlib
+
+from psycopg2.extensions import parse_dsn
+
+from common.db_pool import pool_from_env
+
+PIN_SLOTS = int(os.getenv('REPLICA_PIN_SLOTS', '65536'))
+
+# Pin a user past any replica when the write's position is unknown
+UNKNOWN_LSN = 2 ** 64 - 1
+
+_PIN = struct.Struct('Qd')
+
+PROBE_SQL = """
+    SELECT pg_is_in_recovery(), pg_last_wal_replay_lsn()::text,
+           CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+
+def parse_lsn(text):
+    """``'16/B374D848'`` -> an integer WAL position"""
+    high, low = text.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def format_lsn(lsn):
+    return f'{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}'
+
+
+def current_lsn(conn):
+    """The primary's current WAL position, read on ``conn``"""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_current_wal_lsn()::text")
+        return parse_lsn(cur.fetchone()[0])
+    finally:
+        cur.close()
+
+
+def replica_name(dsn):
+    """``host:port/dbname`` for a DSN, without its credentials"""
+    params = parse_dsn(dsn)
+    return f"{params.get('host', 'localhost')}:{params.get('port', '5432')}/{params.get('dbname', '')}"
+
+
+class WritePins:
+    """Per-user ``(lsn, pinned until)`` in shared memory"""
+
+    def __init__(self, slots=PIN_SLOTS):
+        self.slots = slots
+        self._mem = mmap.mmap(-1, slots * _PIN.size)
+        self._lock = multiprocessing.Lock()
+
+    def _offset(self, key):
+        return (zlib.crc32(str(key).encode()) % self.slots) * _PIN.size
+
+    def pin(self, key, lsn, until):
+        offset = self._offset(key)
+        with self._lock:
+            old_lsn, old_until = _PIN.unpack_from(self._mem, offset)
+            # Colliding users share the slot; keep the stricter pin
+            _PIN.pack_into(self._mem, offset, max(lsn, old_lsn), max(until, old_until))
+
+    def get(self, key):
+        """The LSN ``key``'s reads must see, or 0 when they aren't pinned"""
+        with self._lock:
+            lsn, until = _PIN.unpack_from(self._mem, self._offset(key))
+        # CLOCK_MONOTONIC is system-wide, so every worker agrees on the deadline
+        return lsn if time.monotonic() < until else 0
+
+
+class Replica:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.healthy = False
+        self.replay_lsn = 0
+        self.lag_seconds = None
+        self.error = 'not probed yet'
+        self.checked_at = None
+        self.reads = 0
+        self.fallbacks = 0
+
+
+class ReplicaRouter:
+    """Picks the pool a read runs on and remembers which pool each connection came from"""
+
+    def __init__(self, primary, replicas, pin_seconds=10.0, max_lag=5.0, check_interval=1.0,
+                 probe_timeout=1.0):
+        self.primary = primary
+        self.replicas = [Replica(name, pool) for name, pool in replicas]
+        self.pin_seconds = pin_seconds
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.probe_timeout = probe_timeout
+
+        self.pins = WritePins()
+        self._owners = {}
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._primary_lsn = None
+        self._stats = {'replica_reads': 0, 'primary_reads': 0, 'pinned_reads': 0, 'writes_noted': 0}
+
+    def getconn(self, key):
+        """A connection for a read by user ``key``: a caught-up replica when there is one"""
+        self._start()
+        min_lsn = self.pins.get(key)
+        candidates = [
+            replica for replica in self.replicas
+            if replica.healthy and replica.lag_seconds <= self.max_lag and replica.replay_lsn >= min_lsn
+        ]
+        if candidates:
+            replica = candidates[next(self._next) % len(candidates)]
+            try:
+                conn = replica.pool.getconn()
+            except Exception as e:
+                print(f"Replica {replica.name} checkout failed, reading from the primary: {e}")
+                with self._lock:
+                    replica.healthy = False
+                    replica.error = str(e)
+                    replica.fallbacks += 1
+            else:
+                with self._lock:
+                    self._owners[id(conn)] = replica.pool
+                    replica.reads += 1
+                    self._stats['replica_reads'] += 1
+                return conn
+
+        with self._lock:
+            self._stats['primary_reads'] += 1
+            if min_lsn:
+                self._stats['pinned_reads'] += 1
+        return self.primary.getconn()
+
+    def putconn(self, conn):
+        with self._lock:
+            pool = self._owners.pop(id(conn), self.primary)
+        pool.putconn(conn)
+
+    def note_write(self, key, conn=None):
+        """Pin ``key``'s reads until replicas have replayed its committed write.
+
+        ``conn`` is a primary connection to read the WAL position on; without
+        one a connection is checked out for it.
+        """
+        try:
+            if conn is not None:
+                lsn = current_lsn(conn)
+            else:
+                with self.primary.connection() as conn:
+                    lsn = current_lsn(conn)
+        except Exception as e:
+            print(f"Could not read the WAL position after a write, pinning to the primary: {e}")
+            lsn = UNKNOWN_LSN
+        self.pins.pin(key, lsn, time.monotonic() + self.pin_seconds)
+        with self._lock:
+            self._stats['writes_noted'] += 1
+
+    def _start(self):
+        # Like the group committer, each gunicorn worker starts its own prober
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._owners.clear()
+                self._thread = threading.Thread(target=self._run, name='replica-probe', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self.probe()
+            time.sleep(self.check_interval)
+
+    def probe(self):
+        """Refresh every replica's health, replay position and lag"""
+        try:
+            with self.primary.connection(self.probe_timeout) as conn:
+                primary_lsn = current_lsn(conn)
+        except Exception as e:
+            print(f"Replica probe could not reach the primary: {e}")
+            primary_lsn = None
+
+        for replica in self.replicas:
+            healthy, replay_lsn, lag, error = False, 0, None, None
+            try:
+                with replica.pool.connection(self.probe_timeout) as conn:
+                    cur = conn.cursor()
+                    try:
+                        cur.execute(PROBE_SQL)
+                        in_recovery, replay, lag = cur.fetchone()
+                    finally:
+                        cur.close()
+                if not in_recovery:
+                    error = 'not in recovery'
+                elif replay is None:
+                    error = 'no WAL replayed yet'
+                else:
+                    healthy, replay_lsn, lag = True, parse_lsn(replay), float(lag or 0)
+            except Exception as e:
+                error = str(e)
+
+            with self._lock:
+                replica.healthy = healthy
+                replica.replay_lsn = replay_lsn
+                replica.lag_seconds = lag
+                replica.error = error
+                replica.checked_at = time.time()
+                self._primary_lsn = primary_lsn
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                primary_lsn=format_lsn(self._primary_lsn) if self._primary_lsn is not None else None,
+                pin_seconds=self.pin_seconds,
+                max_lag_seconds=self.max_lag,
+                replicas=[
+                    {
+                        'name': replica.name,
+                        'healthy': replica.healthy,
+                        'eligible': replica.healthy and replica.lag_seconds <= self.max_lag,
+                        'replay_lsn': format_lsn(replica.replay_lsn) if replica.healthy else None,
+                        'lag_seconds': replica.lag_seconds,
+                        'lag_bytes': (max(self._primary_lsn - replica.replay_lsn, 0)
+                                      if replica.healthy and self._primary_lsn is not None else None),
+                        'error': replica.error,
+                        'checked_at': replica.checked_at,
+                        'reads': replica.reads,
+                        'fallbacks': replica.fallbacks,
+                        'pool': replica.pool.stats(),
+                    }
+                    for replica in self.replicas
+                ],
+            )
+
+
+def router_from_env(primary, **pool_kwargs):
+    """A ReplicaRouter over ``primary`` when DATABASE_REPLICA_URLS is set, else None
+
+    Replica pools take the DB_POOL_* settings and ``pool_kwargs``.
+    """
+    urls = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    if not urls:
+        return None
+    return ReplicaRouter(
+        primary,
+        [(replica_name(url), pool_from_env(url, **pool_kwargs)) for url in urls],
+        pin_seconds=float(os.getenv('REPLICA_PIN_SECONDS', '10')),
+        max_lag=float(os.getenv('REPLICA_MAX_LAG', '5')),
+        check_interval=float(os.getenv('REPLICA_CHECK_INTERVAL', '1')),
+    )
@@ -0,0 +1,164 @@
+"""Expense search: full-text over description and category, plus filters.
+
+``q`` is split into words and every word must match, as a prefix, a word
+of the description or the category ("ube" finds "Uber ride"). Matching
+uses English stemming, so "rides" also finds "ride". Results are ranked by
+``ts_rank_cd`` and then newest first; ``sort=date`` (and any search without
+``q``) orders them newest first only.
+
+Matching and ranking use the stored ``expenses.search_vector`` column and
+its ``idx_expenses_search`` GIN index (init-db.sql). Category and date
+filters are served by ``idx_expenses_user_category_date``.
+
+Pages use a keyset cursor over (rank, date, id). Ranking has to score every
+match before the first page can be returned, so a very common word in a big
+ledger costs far more than a rare one. ``sort=date`` avoids that: Postgres
+can walk the (user_id, date DESC, id DESC) index and stop after one page.
+"""
+
+import base64
+import json
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+import rowjson
+from pagination import RECORD_COLUMNS
+
+# Must match the configuration search_vector is generated with
+SEARCH_CONFIG = 'english'
+SEARCH_VECTOR = 'search_vector'
+
+MAX_QUERY_LENGTH = 200
+MAX_TERMS = 10
+SORTS = ('relevance', 'date')
+
+_TERM_RE = re.compile(r'\w+')
+
+
+class SearchError(ValueError):
+    """Raised for malformed search parameters"""
+
+
+def parse_args(args):
+    """Validate query arguments into a dict of filters (limit and cursor excluded)"""
+    q = args.get('q', '').strip()
+    if len(q) > MAX_QUERY_LENGTH:
+        raise SearchError(f'q must be at most {MAX_QUERY_LENGTH} characters')
+    filters = {'terms': _TERM_RE.findall(q.lower())[:MAX_TERMS], 'category': args.get('category') or None}
+
+    sort = args.get('sort', 'relevance')
+    if sort not in SORTS:
+        raise SearchError(f"sort must be one of {', '.join(SORTS)}")
+    filters['ranked'] = bool(filters['terms']) and sort == 'relevance'
+
+    for name in ('min', 'max'):
+        value = args.get(name)
+        try:
+            filters[name] = Decimal(value) if value else None
+        except InvalidOperation:
+            raise SearchError(f'{name} must be a number')
+    for name in ('from', 'to'):
+        value = args.get(name)
+        try:
+            filters[name] = date.fromisoformat(value) if value else None
+        except ValueError:
+            raise SearchError(f'{name} must be YYYY-MM-DD')
+    return filters
+
+
+def encode_cursor(rank, record):
+    record_date = record['date']
+    if isinstance(record_date, date):
+        record_date = record_date.isoformat()
+    raw = json.dumps([rank, record_date, record['id']], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        rank, record_date, record_id = json.loads(raw)
+        return float(rank), date.fromisoformat(record_date), int(record_id)
+    except (ValueError, TypeError):
+        raise SearchError('Invalid cursor')
+
+
+def search_query(user_id, filters, limit, after=None):
+    """SQL and parameters returning up to ``limit + 1`` expenses with a ``rank`` column"""
+    conditions = ["user_id = %(user_id)s"]
+    params = {'user_id': user_id, 'limit': limit + 1}
+
+    if filters['terms']:
+        # Words only, so the tsquery syntax can't be injected
+        params['tsquery'] = ' & '.join(f'{term}:*' for term in filters['terms'])
+        conditions.append(f"{SEARCH_VECTOR} @@ to_tsquery('{SEARCH_CONFIG}', %(tsquery)s)")
+    if filters['ranked']:
+        rank = f"ts_rank_cd({SEARCH_VECTOR}, to_tsquery('{SEARCH_CONFIG}', %(tsquery)s))::real"
+    else:
+        rank = "0::real"
+
+    for column, op, name in (('category', '=', 'category'), ('amount', '>=', 'min'),
+                             ('amount', '<=', 'max'), ('date', '>=', 'from'), ('date', '<=', 'to')):
+        if filters[name] is not None:
+            conditions.append(f"{column} {op} %({name})s")
+            params[name] = filters[name]
+
+    # Unranked every rank is 0; ordering by date alone lets the
+    # (user_id, date DESC, id DESC) indexes return rows already in order
+    order = ['date', 'id']
+    if filters['ranked']:
+        order.insert(0, rank)
+    if after:
+        after_values = ['%(after_date)s', '%(after_id)s']
+        if filters['ranked']:
+            after_values.insert(0, '%(after_rank)s::real')
+        conditions.append(f"({', '.join(order)}) < ({', '.join(after_values)})")
+        params.update(after_rank=after[0], after_date=after[1], after_id=after[2])
+
+    sql = f"""
+        SELECT {RECORD_COLUMNS['expenses']}, {rank} AS rank FROM expenses
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {', '.join(f'{column} DESC' for column in order)}
+        LIMIT %(limit)s
+    """
+    return sql, params
+
+
+def search_page(rows, limit):
+    """Response body from up to ``limit + 1`` rows that carry a ``rank``"""
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(items[-1]['rank'], items[-1])
+    for item in items:
+        del item['rank']
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+def encode_page(cur, rows, limit):
+    """``search_page`` for tuple rows fetched from ``cur``, encoded by ``rowjson``"""
+    return rowjson.encode_page(cur, rows, limit, cursor=lambda record: encode_cursor(record['rank'], record),
+                               exclude=('rank',))
+
+
+def filter_records(records, filters):
+    """Apply the same search to in-memory records; returns them with ``rank`` 0"""
+    results = []
+    for record in records:
+        words = _TERM_RE.findall(f"{record.get('description') or ''} {record.get('category') or ''}".lower())
+        if not all(any(word.startswith(term) for word in words) for term in filters['terms']):
+            continue
+        if filters['category'] is not None and record.get('category') != filters['category']:
+            continue
+        amount = Decimal(str(record['amount']))
+        if (filters['min'] is not None and amount < filters['min']) or \
+                (filters['max'] is not None and amount > filters['max']):
+            continue
+        record_date = record['date']
+        if isinstance(record_date, str):
+            record_date = date.fromisoformat(record_date)
+        if (filters['from'] and record_date < filters['from']) or (filters['to'] and record_date > filters['to']):
+            continue
+        results.append(dict(record, rank=0.0))
+    return results
@@ -0,0 +1,140 @@
+"""Per-user data versions for conditional GETs.
+
+Every committed write bumps the writing user's version; read handlers derive
+a strong ETag from it, so an ``If-None-Match`` poll is answered with 304
+before any SQL runs.
+
+A 304 is only correct if every process that can take the user's writes bumps
+the same counter. Versions therefore live in a memory-mapped file on tmpfs
+(``DATA_VERSION_FILE``, by default one per port under /dev/shm) rather than
+in one process's memory. Every process that opens the file shares it:
+workers forked from a preloaded master, workers that import the app
+themselves (``preload_app = False``, ``uvicorn --workers``), and the old and
+new masters while a USR2 reload overlaps.
+
+The file is shared per host, so every finance-service process serving the
+same users must run on one host (or share the file through a tmpfs volume).
+Instances on separate hosts behind one load balancer would each answer 304
+for writes they never saw.
+
+Users are hashed into a fixed number of slots: a collision only makes a bump
+invalidate another user's ETag as well, which costs a full response but
+never serves stale data. The file starts with a random epoch that goes into
+every ETag, so tags issued before the file was recreated (after a reboot, or
+by a file with other settings) never match.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import zlib
+
+from flask import make_response, request
+
+VERSION_SLOTS = int(os.getenv('DATA_VERSION_SLOTS', '65536'))
+
+
+def _default_file():
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, f"finflow-data-versions-{os.getenv('PORT', '5002')}-{VERSION_SLOTS}")
+
+
+VERSION_FILE = os.getenv('DATA_VERSION_FILE') or _default_file()
+
+_SLOT = struct.Struct('Q')
+# The epoch takes the first slot; user slots follow
+_HEADER = _SLOT.size
+
+# POSIX record locks only exclude other processes, so threads take this first
+_thread_lock = threading.Lock()
+
+
+class DataVersions:
+    def __init__(self, slots=VERSION_SLOTS, path=VERSION_FILE):
+        self.slots = slots
+        self.path = path
+        size = _HEADER + slots * _SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._mem = mmap.mmap(self._fd, size)
+        self.epoch = self._epoch()
+
+    def _locked(self, offset, fn):
+        with _thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, _SLOT.size, offset)
+            try:
+                return fn()
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, _SLOT.size, offset)
+
+    def _epoch(self):
+        def read_or_create():
+            epoch = _SLOT.unpack_from(self._mem, 0)[0]
+            if not epoch:
+                epoch = int.from_bytes(os.urandom(4), 'big') or 1
+                _SLOT.pack_into(self._mem, 0, epoch)
+            return epoch
+        return f'{self._locked(0, read_or_create):08x}'
+
+    def _offset(self, key):
+        return _HEADER + (zlib.crc32(str(key).encode()) % self.slots) * _SLOT.size
+
+    def get(self, key):
+        return _SLOT.unpack_from(self._mem, self._offset(key))[0]
+
+    def bump(self, key):
+        """Advance a user's version; call after the write has committed"""
+        offset = self._offset(key)
+
+        def increment():
+            version = _SLOT.unpack_from(self._mem, offset)[0] + 1
+            _SLOT.pack_into(self._mem, offset, version)
+            return version
+        return self._locked(offset, increment)
+
+    def etag(self, key, variant=''):
+        """Strong ETag for the current version of ``key``'s data"""
+        variant_digest = hashlib.sha1(variant.encode()).hexdigest()[:8]
+        return f'{self.epoch}-{self.get(key)}-{variant_digest}'
+
+
+def data_key(user):
+    """Version key for a token payload; test users live in the memory store"""
+    if user.get('type') == 'test':
+        return f"test:{user['user_id']}"
+    return user['user_id']
+
+
+def conditional(versions):
+    """Answer ``If-None-Match`` with 304 and tag responses with the data ETag.
+
+    Must sit below ``require_auth`` so the user is known. The version is
+    read before the handler runs so a write that commits mid-request can
+    only make the ETag older than the data, never newer. Responses marked
+    ``no-store``, such as mock fallbacks, get no ETag.
+    """
+    def decorator(f):
+        def decorated_function(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return f(*args, **kwargs)
+
+            variant = f'{request.full_path}|{request.accept_mimetypes}'
+            etag = versions.etag(data_key(request.user), variant)
+
+            if etag in request.if_none_match:
+                # Same Vary as the 200 it revalidates
+                return '', 304, {'ETag': f'"{etag}"', 'Vary': 'Accept'}
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.cache_control.no_store:
+                response.set_etag(etag)
+                response.vary.add('Accept')
+            return response
+        decorated_function.__name__ = f.__name__
+        return decorated_function
+    return decorator
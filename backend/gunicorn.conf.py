@@ -0,0 +1,90 @@
+"""Gunicorn settings shared by every backend service.
+
+Used by serve.py locally and by the service Dockerfiles. The app is imported
+once in the master and workers are forked from it, so code and read-only data
+are shared copy-on-write. Database pools, upstream sessions and the hashing
+process pool all connect lazily, so nothing opened before the fork is shared
+between workers.
+"""
+
+import itertools
+import os
+import shutil
+import tempfile
+
+
+def _cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY') or _cpu_count() * 2 + 1)
+# Exported so per-worker resources, such as auth-service's hashing pool, can size themselves
+os.environ['WEB_CONCURRENCY'] = str(workers)
+# Threaded workers: the main loop keeps heartbeating while request threads
+# stream exports, NDJSON pages and bulk uploads, so ``timeout`` only catches
+# a hung worker, and a long stream ties up one thread rather than a whole
+# worker. A sync worker only heartbeats between requests and is killed by
+# ``timeout`` partway through any stream that runs longer.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+
+preload_app = True
+
+# Recycle workers so slow leaks can't accumulate; jitter keeps them from all
+# restarting at once
+max_requests = int(os.getenv('MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('MAX_REQUESTS_JITTER', '100'))
+
+timeout = int(os.getenv('WORKER_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('KEEPALIVE', '5'))
+
+# Heartbeat files on tmpfs so a slow container disk can't get workers killed
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = os.getenv('ACCESS_LOG', '-') or None
+errorlog = '-'
+# The request ID ties together the log lines of one request across services
+access_log_format = '%(h)s %(t)s "%(r)s" %(s)s %(b)s %(M)sms rid=%({x-request-id}o)s'
+
+# Workers write Prometheus samples to per-process files that /metrics merges.
+# This has to be in the environment before the app imports prometheus_client.
+os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(tempfile.gettempdir(), f"finflow-metrics-{os.getenv('PORT', '5000')}")
+)
+
+# Profiled workers write their stacks here for /debug/profile to merge
+os.environ.setdefault(
+    'PROFILING_DIR',
+    os.path.join(tempfile.gettempdir(), f"finflow-profiles-{os.getenv('PORT', '5000')}")
+)
+
+
+def on_starting(server):
+    # Samples left by a previous run would be merged into this one
+    for directory in (os.environ['PROMETHEUS_MULTIPROC_DIR'], os.environ['PROFILING_DIR']):
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def pre_fork(server, worker):
+    # A replacement worker takes over the metric files of the one it replaces,
+    # reading its counters back in, so recycling doesn't grow the directory
+    used = {getattr(live, 'metrics_slot', None) for live in server.WORKERS.values()}
+    worker.metrics_slot = next(slot for slot in itertools.count() if slot not in used)
+
+
+def post_fork(server, worker):
+    try:
+        from prometheus_client import values
+    except ImportError:
+        return
+    # Unique among running processes, including a second master during reload
+    identifier = f'{server.pid}_{worker.metrics_slot}'
+    values.ValueClass = values.MultiProcessValue(lambda: identifier)
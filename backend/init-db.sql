@@ -1,3 +1,5 @@
+-- Runs once, when the Postgres volume is created. Existing databases are
+-- upgraded with migrate.py; every schema change here needs a step there too.
 
 -- Create database and user
 CREATE DATABASE finflow_db;
@@ -44,11 +46,56 @@ CREATE TABLE budgets (
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     category VARCHAR(50) NOT NULL,
     budgeted DECIMAL(10,2) NOT NULL,
-    spent DECIMAL(10,2) DEFAULT 0,
     period VARCHAR(20) DEFAULT 'monthly',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+CREATE INDEX idx_budgets_user_category ON budgets (user_id, category);
+
+-- First day of the budget period (weekly, monthly, quarterly, yearly) containing d
+CREATE FUNCTION budget_period_start(period VARCHAR, d DATE) RETURNS DATE AS $$
+    SELECT date_trunc(
+        CASE period
+            WHEN 'weekly' THEN 'week'
+            WHEN 'quarterly' THEN 'quarter'
+            WHEN 'yearly' THEN 'year'
+            ELSE 'month'
+        END, d)::date
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- Spend per budget and period, maintained by finance-service on every
+-- expense write. Rebuild with: python finance-service/budgets.py rebuild
+CREATE TABLE budget_spend (
+    budget_id INTEGER REFERENCES budgets(id) ON DELETE CASCADE,
+    period_start DATE NOT NULL,
+    spent DECIMAL(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (budget_id, period_start)
+);
+
+-- Keyset pagination indexes: WHERE user_id = ? ORDER BY date DESC, id DESC
+CREATE INDEX idx_expenses_user_date_id ON expenses (user_id, date DESC, id DESC);
+CREATE INDEX idx_income_user_date_id ON income (user_id, date DESC, id DESC);
+
+-- Expense search (finance-service/search.py). The vector is stored so that
+-- ranking doesn't re-parse every matching description.
+ALTER TABLE expenses ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(description, '') || ' ' || coalesce(category, ''))) STORED;
+CREATE INDEX idx_expenses_search ON expenses USING GIN (search_vector);
+CREATE INDEX idx_expenses_user_category_date ON expenses (user_id, category, date DESC, id DESC);
+
+-- Per-user monthly totals by category (expenses) or source (income),
+-- maintained by finance-service on every write. Rebuild with:
+--   python finance-service/rollups.py rebuild
+CREATE TABLE monthly_rollups (
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    kind VARCHAR(10) NOT NULL,
+    month DATE NOT NULL,
+    category VARCHAR(100) NOT NULL DEFAULT '',
+    total DECIMAL(14,2) NOT NULL DEFAULT 0,
+    entry_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, kind, month, category)
+);
+
 -- Wishlist table
 CREATE TABLE wishlist (
     id SERIAL PRIMARY KEY,
@@ -0,0 +1,144 @@
+"""Production launcher for the FinFlow backend services.
+
+Runs a service under gunicorn with the shared settings in gunicorn.conf.py
+(preforked, preloaded gthread workers with GUNICORN_THREADS threads each,
+recycled after MAX_REQUESTS requests). Threaded workers keep heartbeating
+while a thread streams, so exports, NDJSON lists and bulk uploads can run
+longer than WORKER_TIMEOUT; sync workers would be killed mid-stream:
+
+    python serve.py finance-service
+    python serve.py finance-service --asgi      # async entry point on uvicorn workers
+    python serve.py api-gateway --workers 8
+
+Reload new code without dropping requests:
+
+    python serve.py finance-service --reload
+
+This sends USR2 to the running master, which starts a second master and new
+workers on the same listening socket. Once the new master is up, the old one
+is sent TERM and finishes its in-flight requests before exiting (streams still
+running after GRACEFUL_TIMEOUT are cut off). A plain HUP would not pick up new
+code, because the app is preloaded in the master.
+"""
+
+import argparse
+import os
+import signal
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Service -> (directory under backend/, default port)
+SERVICES = {
+    'backend': ('.', 5001),
+    'simple-auth': ('simple-auth', 5001),
+    'auth-service': ('auth-service', 5001),
+    'finance-service': ('finance-service', 5002),
+    'api-gateway': ('api-gateway', 5000),
+}
+
+
+def default_pidfile(service):
+    return os.path.join(os.getenv('RUN_DIR', '/tmp'), f'finflow-{service}.pid')
+
+
+def read_pid(pidfile):
+    try:
+        with open(pidfile) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def start(service, args):
+    directory, port = SERVICES[service]
+    env = dict(os.environ)
+    env['PORT'] = str(args.port or env.get('PORT') or port)
+    if args.workers:
+        env['WEB_CONCURRENCY'] = str(args.workers)
+
+    target = 'app:app'
+    if args.asgi:
+        target = 'asgi_app:app'
+        env['GUNICORN_WORKER_CLASS'] = 'uvicorn.workers.UvicornWorker'
+
+    # Run the console script rather than ``python -m gunicorn``: USR2 re-executes
+    # sys.argv, and re-running gunicorn/__main__.py as a script would put the
+    # gunicorn package directory (and its ``http`` module) first on sys.path
+    argv = [
+        'gunicorn',
+        '--config', os.path.join(BACKEND_DIR, 'gunicorn.conf.py'),
+        '--chdir', os.path.join(BACKEND_DIR, directory),
+        '--pid', args.pidfile,
+        target,
+    ]
+    print(f"Starting {service} on port {env['PORT']}...")
+    os.execvpe('gunicorn', argv, env)
+
+
+def reload(service, args):
+    old_pid = read_pid(args.pidfile)
+    if not old_pid or not is_running(old_pid):
+        print(f"{service} is not running (no live pid in {args.pidfile})")
+        return 1
+
+    print(f"Starting new master for {service} (old master {old_pid})...")
+    os.kill(old_pid, signal.SIGUSR2)
+
+    # The new master writes PIDFILE.2 and renames it to PIDFILE once the old
+    # master has exited
+    deadline = time.monotonic() + args.timeout
+    new_pid = None
+    while time.monotonic() < deadline:
+        pid = read_pid(args.pidfile + '.2')
+        if pid and pid != old_pid and is_running(pid):
+            new_pid = pid
+            break
+        time.sleep(0.2)
+
+    if new_pid is None:
+        print("New master did not start; old master left serving")
+        return 1
+
+    # Give the new master time to fork its workers before the old ones stop accepting
+    time.sleep(args.settle)
+    if not is_running(new_pid):
+        print("New master exited during startup; old master left serving")
+        return 1
+
+    os.kill(old_pid, signal.SIGTERM)
+    print(f"Reloaded {service}: master {new_pid} serving, {old_pid} draining")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('service', choices=sorted(SERVICES))
+    parser.add_argument('--asgi', action='store_true', help='serve asgi_app:app on uvicorn workers')
+    parser.add_argument('--workers', type=int, help='worker processes, each with GUNICORN_THREADS threads (default: 2 * cores + 1)')
+    parser.add_argument('--port', type=int, help='port to bind (default: the service port)')
+    parser.add_argument('--pidfile', help='master pid file (default: $RUN_DIR/finflow-SERVICE.pid)')
+    parser.add_argument('--reload', action='store_true', help='gracefully reload a running server')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for the new master')
+    parser.add_argument('--settle', type=float, default=2, help='seconds to let new workers boot')
+    args = parser.parse_args()
+    args.pidfile = args.pidfile or default_pidfile(args.service)
+
+    if args.reload:
+        return reload(args.service, args)
+    return start(args.service, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,4 @@
-
+import argparse
 import subprocess
 import sys
 import os
@@ -8,12 +8,23 @@ def install_requirements():
     print("Installing Python requirements...")
     subprocess.run([sys.executable, "-m", "pip", "install", "-r", "backend/simple-auth/requirements.txt"])
 
-def start_backend():
+def start_backend(dev=False):
     """Start the Flask backend"""
     print("Starting FinFlow backend...")
-    os.chdir("backend/simple-auth")
-    subprocess.run([sys.executable, "app.py"])
+    if dev:
+        os.chdir("backend/simple-auth")
+        env = dict(os.environ, FLASK_DEBUG="1")
+        subprocess.run([sys.executable, "app.py"], env=env)
+    else:
+        os.chdir("backend")
+        subprocess.run([sys.executable, "serve.py", "simple-auth"])
 
 if __name__ == "__main__":
-    install_requirements()
-    start_backend()
+    parser = argparse.ArgumentParser(description="Start the FinFlow backend")
+    parser.add_argument("--install", action="store_true", help="pip install requirements first")
+    parser.add_argument("--dev", action="store_true", help="use the Flask debug server")
+    args = parser.parse_args()
+
+    if args.install:
+        install_requirements()
+    start_backend(dev=args.dev)